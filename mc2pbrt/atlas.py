@@ -0,0 +1,115 @@
+import os
+import hashlib
+import json
+from PIL import Image
+
+from resource import ResourceManager
+
+class TextureAtlas:
+    """Pack block textures into a few atlas images
+
+    Every texture keeps its own size and gets a gutter of `padding` pixels
+    filled with its edge texels, so filtering near a tile border never
+    reads a neighbour tile. Pages are power of two sized, pbrt would
+    resample them otherwise.
+    """
+
+    def __init__(self, texture_names, name="atlas", padding=4, max_size=2048):
+        """
+        Args:
+            texture_names: textures to pack, without ".png".
+            name: prefix of page files and pbrt textures.
+            padding: gutter around every tile in pixels.
+            max_size: maximum width and height of a page.
+        """
+        self.name = name
+        self.padding = padding
+        self.max_size = max_size
+        self.tiles = {}
+        self.pages = []
+        self._pack(sorted(texture_names))
+
+    def _pack(self, texture_names):
+        """Shelf packing, tallest textures first"""
+        rm = ResourceManager()
+        sizes = {tex: rm.textureInfo(tex + ".png")["size"] for tex in texture_names}
+        order = sorted(texture_names, key=lambda tex: (-sizes[tex][1], -sizes[tex][0], tex))
+
+        pad = self.padding
+        page, x, y, shelf_h, used_w = 0, 0, 0, 0, 0
+        for tex in order:
+            w, h = sizes[tex]
+            cell_w, cell_h = w + 2*pad, h + 2*pad
+            if x + cell_w > self.max_size:
+                x, y, shelf_h = 0, y + shelf_h, 0
+            if y + cell_h > self.max_size and (x, y) != (0, 0):
+                self.pages.append(self._pageSize(used_w, y + shelf_h))
+                page, x, y, shelf_h, used_w = page + 1, 0, 0, 0, 0
+            self.tiles[tex] = (page, x + pad, y + pad, w, h)
+            x += cell_w
+            shelf_h = max(shelf_h, cell_h)
+            used_w = max(used_w, x)
+        if order:
+            self.pages.append(self._pageSize(used_w, y + shelf_h))
+
+    def _pageSize(self, w, h):
+        return ((1 << (w - 1).bit_length()), (1 << (h - 1).bit_length()))
+
+    def pageName(self, page):
+        return "%s%d" % (self.name, page)
+
+    def digest(self):
+        """Hash of the layout, geometry written with remap depends on it"""
+        layout = [self.name, self.pages, sorted(self.tiles.items())]
+        return hashlib.sha1(json.dumps(layout).encode("utf-8")).hexdigest()
+
+    def save(self, folder):
+        """Write the page images into folder"""
+        rm = ResourceManager()
+        images = [Image.new("RGBA", size) for size in self.pages]
+        pad = self.padding
+        for tex, (page, x, y, w, h) in self.tiles.items():
+            full_filename = os.path.join(rm.scene_folder, tex + ".png")
+            with Image.open(full_filename) as image:
+                tile = image.convert("RGBA")
+            atlas = images[page]
+            atlas.paste(tile, (x, y))
+            if pad == 0:
+                continue
+            # Gutter: stretch edge rows, then edge columns with the corners
+            atlas.paste(tile.crop((0, 0, w, 1)).resize((w, pad)), (x, y - pad))
+            atlas.paste(tile.crop((0, h - 1, w, h)).resize((w, pad)), (x, y + h))
+            left = atlas.crop((x, y - pad, x + 1, y + h + pad))
+            right = atlas.crop((x + w - 1, y - pad, x + w, y + h + pad))
+            atlas.paste(left.resize((pad, h + 2*pad)), (x - pad, y - pad))
+            atlas.paste(right.resize((pad, h + 2*pad)), (x + w, y - pad))
+
+        for page, image in enumerate(images):
+            image.save(os.path.join(folder, self.pageName(page) + ".png"))
+
+    def writeTextures(self, fout):
+        """Declare pbrt textures of the pages, alpha only where it is used"""
+        rm = ResourceManager()
+        alpha_pages = set(page for tex, (page, x, y, w, h) in self.tiles.items()
+                          if rm.hasAlpha(tex + ".png"))
+        for page in range(len(self.pages)):
+            fn = self.pageName(page)
+            fout.write('Texture "%s-color" "spectrum" "imagemap" "string filename" "%s.png"\n' % (fn, fn))
+            if page in alpha_pages:
+                fout.write('Texture "%s-alpha" "float" "imagemap" "bool alpha" "true" "string filename" "%s.png"\n' % (fn, fn))
+
+    def remap(self, tex, uv):
+        """Move face UV of texture tex into its atlas tile
+
+        Args:
+            tex: texture name.
+            uv: (u0, v0, u1, v1) as stored by ModelLoader, u runs down the
+                rows of the texture from the top and v along the columns.
+        Returns:
+            (pbrt texture name of the page, remapped uv)
+        """
+        page, x, y, w, h = self.tiles[tex]
+        page_w, page_h = self.pages[page]
+        u0, v0, u1, v1 = uv
+        return self.pageName(page), ((y + u0*h) / page_h, (x + v0*w) / page_w,
+                                     (y + u1*h) / page_h, (x + v1*w) / page_w)
@@ -0,0 +1,350 @@
+"""Micro benchmarks for the world loading and export pipeline.
+
+Usage:
+    $ python benchmark.py nbt [path-to-world]/region/r.0.0.mca
+"""
+import argparse
+import os
+import queue
+import random
+import struct
+import time
+import zlib
+
+import pyanvil.nbt as nbt
+import pyanvil.stream as stream
+from pyanvil.world import World, Chunk, pack_block_states, unpack_block_states
+from block.blocksolver import BlockSolver
+from tuple_calculation import plus_i
+
+
+def _regionChunks(region_fn):
+    """Read every decompressed chunk payload in a region file
+
+    Args:
+        region_fn: filename of region (.mca) file.
+    Returns:
+        List of decompressed nbt payloads.
+    """
+    with open(region_fn, "rb") as f:
+        data = f.read()
+
+    payloads = []
+    for loc in struct.unpack_from(">1024I", data):
+        if not loc:
+            continue
+        offset = (loc >> 8)*4096
+        length, = struct.unpack_from(">I", data, offset)
+        payloads.append(zlib.decompress(data[offset+5:offset+4+length]))
+    return payloads
+
+
+def _timeit(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+class _RefStream:
+    """The bytes slicing InputStream parse_nbt used to read from"""
+    def __init__(self, data):
+        self.pos = 0
+        self.buffer = bytes(data)
+
+    def read(self, num):
+        rtn = self.buffer[self.pos:self.pos + num]
+        self.pos = self.pos + num
+        return rtn
+
+    def peek(self):
+        return self.buffer[self.pos]
+
+
+_REF_SIMPLE = {1: (1, ">b"), 2: (2, ">h"), 3: (4, ">i"), 4: (8, ">q"), 5: (4, ">f"), 6: (8, ">d")}
+_REF_ARRAY = {7: 1, 11: 3, 12: 4}
+
+
+def _refParse(stream, tag_type, name):
+    """The old one struct.unpack per value decoder, tags as (type, name, value)
+
+    Array elements are decoded one tag at a time like the old parser did,
+    lists hold (sub type, children) and compounds a dict of children.
+    """
+    if tag_type in _REF_SIMPLE:
+        width, parser = _REF_SIMPLE[tag_type]
+        return (tag_type, name, struct.unpack(parser, stream.read(width))[0])
+    if tag_type == 8:
+        length = int.from_bytes(stream.read(2), byteorder="big", signed=False)
+        return (tag_type, name, str(stream.read(length), "utf-8"))
+    if tag_type in _REF_ARRAY:
+        length = int.from_bytes(stream.read(4), byteorder="big", signed=True)
+        sub_type = _REF_ARRAY[tag_type]
+        return (tag_type, name, [_refParse(stream, sub_type, "None")[2] for i in range(length)])
+    if tag_type == 9:
+        sub_type = int.from_bytes(stream.read(1), byteorder="big", signed=False)
+        length = int.from_bytes(stream.read(4), byteorder="big", signed=True)
+        return (tag_type, name, (sub_type, [_refParse(stream, sub_type, "None") for i in range(length)]))
+    if tag_type == 10:
+        children = {}
+        while stream.peek() != 0:
+            child = _refParseNamed(stream)
+            children[child[1]] = child
+        stream.read(1)
+        return (tag_type, name, children)
+    raise ValueError("unknown tag type %d" % tag_type)
+
+
+def _refParseNamed(stream):
+    tag_type = int.from_bytes(stream.read(1), byteorder="big", signed=False)
+    name_length = int.from_bytes(stream.read(2), byteorder="big", signed=False)
+    return _refParse(stream, tag_type, str(stream.read(name_length), "utf-8"))
+
+
+def _plainTag(tag):
+    """Convert a parse_nbt tag tree into the form _refParse returns"""
+    tag_type = type(tag).clazz_id
+    if tag_type in _REF_ARRAY:
+        return (tag_type, tag.tag_name, list(tag.values))
+    if tag_type == 9:
+        return (tag_type, tag.tag_name, (tag.sub_type_id, [_plainTag(c) for c in tag.children]))
+    if tag_type == 10:
+        return (tag_type, tag.tag_name, {k: _plainTag(c) for k, c in tag.children.items()})
+    return (tag_type, tag.tag_name, tag.get())
+
+
+def benchNbt(args):
+    payloads = []
+    for region_fn in args.region:
+        payloads += _regionChunks(region_fn)
+    size = sum(map(len, payloads))
+    include = World.CHUNK_INCLUDE if args.chunk_filter else None
+
+    def run():
+        for payload in payloads:
+            nbt.parse_nbt(stream.InputStream(payload), include)
+
+    sec = _timeit(run, args.repeat)
+    print("%d chunks, %.2f MB decompressed nbt" % (len(payloads), size/1e6))
+    print("parse_nbt: %.2f MB/s" % (size/1e6/sec))
+    if args.reference:
+        for i, payload in enumerate(payloads):
+            if _plainTag(nbt.parse_nbt(stream.InputStream(payload))) != _refParseNamed(_RefStream(payload)):
+                raise AssertionError("chunk %d tag tree mismatch" % i)
+
+        def ref():
+            for payload in payloads:
+                _refParseNamed(_RefStream(payload))
+
+        ref_sec = _timeit(ref, args.repeat)
+        print("reference: %.2f MB/s (full tree, %.2fx)" % (size/1e6/ref_sec, ref_sec/sec))
+
+
+def _refReadChunk(region_location, chunk_pos):
+    """The old per chunk load: open the region and read its header again"""
+    if not os.path.exists(region_location):
+        return None
+    with open(region_location, mode="rb") as region:
+        locations = [[
+                    int.from_bytes(region.read(3), byteorder="big", signed=False) * 4096,
+                    int.from_bytes(region.read(1), byteorder="big", signed=False) * 4096
+                ] for i in range(1024)]
+
+        timestamps = region.read(4096)
+
+        offset = locations[(chunk_pos[0] % 32) + (chunk_pos[1] % 32) * 32][0]
+        if offset == 0:
+            return None
+        region.seek(offset)
+        datalen = int.from_bytes(region.read(4), byteorder="big", signed=False)
+        compr = region.read(1)
+        return zlib.decompress(region.read(datalen - 1))
+
+
+def benchChunks(args):
+    world_path = os.path.abspath(args.world)
+    cx, cz = args.center
+    r = args.radius
+    positions = [(cx+dx, cz+dz) for dx in range(-r, r+1) for dz in range(-r, r+1)]
+
+    def run():
+        with World(os.path.basename(world_path), os.path.dirname(world_path)) as world:
+            for pos in positions:
+                if args.raw:
+                    region = world.get_region(world._get_region(pos))
+                    if region is not None:
+                        region.read_chunk(pos)
+                else:
+                    world.get_chunk(pos)
+
+    def ref():
+        world = World(os.path.basename(world_path), os.path.dirname(world_path))
+        for pos in positions:
+            decompressed = _refReadChunk(world._region_location(world._get_region(pos)), pos)
+            if not args.raw and decompressed is not None:
+                World._load_binary_chunk(decompressed)
+
+    sec = _timeit(run, args.repeat)
+    print("%d chunks in %.3fs: %.1f chunk loads/s" % (len(positions), sec, len(positions)/sec))
+    if args.reference:
+        ref_sec = _timeit(ref, args.repeat)
+        print("reference  %.3fs: %.1f chunk loads/s (%.2fx)" % (
+            ref_sec, len(positions)/ref_sec, ref_sec/sec))
+
+
+def benchUnpack(args):
+    rnd = random.Random(0)
+    for width in range(4, 13):
+        states = [rnd.randrange(1 << width) for _ in range(4096)]
+        for spanning in (True, False):
+            longs = pack_block_states(states, width, spanning)
+            if list(unpack_block_states(longs, 1 << width)) != states:
+                raise AssertionError("width %d spanning=%s mismatch" % (width, spanning))
+            sec = _timeit(lambda: unpack_block_states(longs, 1 << width), args.repeat)
+
+            line = "width %2d %-12s unpack_block_states %7.3f ms" % (
+                width, "spanning" if spanning else "non-spanning", sec*1e3)
+            if spanning:
+                ref = lambda: [Chunk._read_width_from_loc(longs, width, i) for i in range(4096)]
+                if ref() != states:
+                    raise AssertionError("width %d reference mismatch" % width)
+                line += "   _read_width_from_loc %7.3f ms" % (_timeit(ref, args.repeat)*1e3)
+            print(line)
+
+
+def benchColumns(args):
+    world_path = os.path.abspath(args.world)
+    world = World(os.path.basename(world_path), os.path.dirname(world_path))
+    cx, cz = args.center
+    r = args.radius
+    ys = range(args.y[0], args.y[1] + 1)
+    columns = [(cx+dx, cz+dz) for dx in range(-r, r+1) for dz in range(-r, r+1)]
+    world.prefetch(set((x//16, z//16) for x, z in columns), workers=1)
+    lookups = len(columns)*len(ys)
+
+    def perBlock():
+        for x, z in columns:
+            for y in ys:
+                world.get_block((x, y, z))
+                world.get_biome((x, y, z))
+
+    def perColumn():
+        for x, z in columns:
+            world.get_column(x, z, ys[0], ys[-1])
+
+    def box():
+        world.get_blocks_box((cx-r, ys[0], cz-r), (cx+r, ys[-1], cz+r))
+
+    for name, func in [("get_block+get_biome", perBlock), ("get_column", perColumn),
+                       ("get_blocks_box", box)]:
+        sec = _timeit(func, args.repeat)
+        print("%-20s %8.3fs %12.0f blocks/s" % (name, sec, lookups/sec))
+
+
+class _Cell:
+    """Stand-in for a block, only passability matters to the traversal"""
+    def __init__(self, passable):
+        self.passable = passable
+
+    def canPass(self):
+        return self.passable
+
+
+def _floodScene(radius, height, rnd):
+    """Terrain of solid cells with air above and scattered holes below"""
+    air, solid = _Cell(True), _Cell(False)
+    sz = 2*radius + 1
+    ground = [[height//2 + rnd.randrange(-4, 5) for x in range(sz)] for z in range(sz)]
+    return [[[air if y >= ground[z][x] or rnd.random() < .05 else solid for x in range(sz)]
+             for z in range(sz)] for y in range(height)]
+
+
+def _queueTraverse(solver, start_pt):
+    """The queue.Queue and tuple set traversal BlockSolver used to have"""
+    que = queue.Queue()
+    rendered = set()
+    visited = []
+    deltas = [(1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, -1, 0), (0, 0, 1), (0, 0, -1)]
+    que.put(start_pt)
+    for delta in deltas:
+        next_pt = plus_i(delta, start_pt)
+        if not solver._inBlock(next_pt): continue
+        que.put(next_pt)
+
+    while not que.empty():
+        pt = que.get()
+        if not solver._inBlock(pt): continue
+        if pt in rendered: continue
+        rendered.add(pt)
+        visited.append(pt)
+        x, y, z = pt
+        if solver.block[y][z][x].canPass():
+            for delta in deltas:
+                next_pt = plus_i(delta, pt)
+                if not solver._inBlock(next_pt): continue
+                if next_pt in rendered: continue
+                que.put(next_pt)
+    return visited
+
+
+def benchFlood(args):
+    rnd = random.Random(0)
+    for radius in args.radius:
+        solver = BlockSolver(_floodScene(radius, args.height, rnd))
+        start_pt = (radius, args.height - 2, radius)
+        visited = solver.traverse(start_pt)
+        sec = _timeit(lambda: solver.traverse(start_pt), args.repeat)
+        line = "radius %3d %9d voxels  traverse %10.0f voxels/s" % (radius, len(visited), len(visited)/sec)
+        if args.reference:
+            if _queueTraverse(solver, start_pt) != visited:
+                raise AssertionError("radius %d visiting order mismatch" % radius)
+            ref_sec = _timeit(lambda: _queueTraverse(solver, start_pt), args.repeat)
+            line += "   queue.Queue %10.0f voxels/s" % (len(visited)/ref_sec)
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    sub = parser.add_subparsers(dest="bench")
+    sub.required = True
+
+    p = sub.add_parser("nbt", help="NBT decode throughput")
+    p.add_argument("region", nargs="+")
+    p.add_argument("--chunk-filter", action="store_true",
+                   help="only decode the paths World reads")
+    p.add_argument("--reference", action="store_true",
+                   help="also time the old struct.unpack per value decoder and compare")
+    p.set_defaults(func=benchNbt)
+
+    p = sub.add_parser("chunks", help="World chunk loads per second")
+    p.add_argument("world")
+    p.add_argument("--radius", type=int, default=8, help="radius in chunks")
+    p.add_argument("--center", type=int, nargs=2, default=(0, 0))
+    p.add_argument("--raw", action="store_true",
+                   help="only read and decompress, skip nbt decoding")
+    p.add_argument("--reference", action="store_true",
+                   help="also time the old open and header read per chunk")
+    p.set_defaults(func=benchChunks)
+
+    p = sub.add_parser("columns", help="Block+biome lookups over a box")
+    p.add_argument("world")
+    p.add_argument("--radius", type=int, default=32, help="radius in blocks")
+    p.add_argument("--center", type=int, nargs=2, default=(0, 0))
+    p.add_argument("--y", type=int, nargs=2, default=(1, 127))
+    p.set_defaults(func=benchColumns)
+
+    p = sub.add_parser("flood", help="BlockSolver visibility traversal")
+    p.add_argument("--radius", type=int, nargs="+", default=(32, 64, 128))
+    p.add_argument("--height", type=int, default=128)
+    p.add_argument("--reference", action="store_true",
+                   help="also time the old queue.Queue traversal and compare")
+    p.set_defaults(func=benchFlood)
+
+    p = sub.add_parser("unpack", help="BlockStates unpacking per section")
+    p.set_defaults(func=benchUnpack)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -1,7 +1,7 @@
 from resource import ResourceManager
-from material import Matte
+from material import Matte, Foliage, Light
 
-from util import pt_map
+from util import pt_map, face_bit
 from tuple_calculation import plus, mult, minus 
 
 class BlockBase:
@@ -64,6 +64,7 @@ class BlockBase:
         # Default Material
         self.material = Matte(self) 
         self.type = ""
+        self._cube = None
 
         self.build()
 
@@ -90,6 +91,107 @@ class BlockBase:
     def empty(self):
         return not self.models
 
+    def _coversCube(self, ele):
+        """Element is the unrotated unit cube with all six faces"""
+        return (ele["from"] == (0, 0, 0) and ele["to"] == (1, 1, 1) and
+                "rotation" not in ele and len(ele["faces"]) == 6)
+
+    def _cubeType(self):
+        """None, "cube" for a full cube or "opaque" for a full opaque cube"""
+        if self._cube is None:
+            self._cube = ""
+            for model, transforms, material in self.models:
+                if transforms: continue
+                for ele in model["elements"]:
+                    if not self._coversCube(ele): continue
+                    opaque = type(material) is Matte and not any(
+                        ResourceManager().hasAlpha(ele["faces"][f]["texture"] + ".png")
+                        for f in ele["faces"])
+                    if opaque:
+                        self._cube = "opaque"
+                    elif not self._cube:
+                        self._cube = "cube"
+        return self._cube or None
+
+    def hasAreaLight(self):
+        return any(isinstance(material, Light) for model, transforms, material in self.models)
+
+    def isRotated(self):
+        """Block or one of its models is turned away from model space"""
+        if "axis" in self.state and self.name != "nether_portal" and self.state["axis"] != "y":
+            return True
+        if "facing" in self.state:
+            return True
+        return any(transforms for model, transforms, material in self.models)
+
+    def occludes(self, other):
+        """Check if this block hides the faces of other touching it
+
+        Full opaque cubes hide everything, other full cubes only hide the
+        faces of the same block, like glass next to glass.
+        """
+        cube = self._cubeType()
+        if cube == "opaque":
+            return True
+        if cube == "cube" and not isinstance(self.material, Foliage):
+            return other.name == self.name and other.state == self.state
+        return False
+
+    def isHidden(self, culled, merged=False):
+        """Check if every face is culled by the culled mask or merged"""
+        if self.isRotated():
+            return False
+        return all(self._isSkipped(ele, f, material, culled, merged)
+                   for model, transforms, material in self.models
+                   for ele in model["elements"] for f in ele["faces"])
+
+    def _isMerged(self, ele, facename, material):
+        """Face can be drawn as a tile of a larger quad by a mesher
+
+        Only faces of unit cube elements with the whole texture, unrotated,
+        and with a plain material qualify.
+        """
+        face = ele["faces"][facename]
+        return (self._coversCube(ele) and "rotation" not in face and
+                face["uv"] == (0, 0, 1, 1) and type(material) is not Light)
+
+    def _isSkipped(self, ele, facename, material, culled, merged):
+        if culled and self._isCulled(ele, facename, culled):
+            return True
+        return merged and self._isMerged(ele, facename, material)
+
+    def meshFaces(self, culled):
+        """Faces a mesher draws for this block instead of write(merged=True)
+
+        Rotated blocks, which include blocks with model transforms, have
+        none.
+
+        Returns:
+            List of (facename, face, material).
+        """
+        if self.isRotated():
+            return []
+        faces = []
+        for model, transforms, material in self.models:
+            for ele in model["elements"]:
+                for facename in ele["faces"]:
+                    if self._isMerged(ele, facename, material) and not self._isCulled(ele, facename, culled):
+                        faces.append((facename, ele["faces"][facename], material))
+        return faces
+
+    def _isCulled(self, ele, facename, culled):
+        """Face has a cullface and is drawn on a side hidden by a neighbour"""
+        face = ele["faces"][facename]
+        if "cullface" not in face or "rotation" in ele:
+            return False
+        if not culled & face_bit[facename]:
+            return False
+        # Only faces lying on the block boundary touch the neighbour
+        axis = "xyz".index(pt_map[facename][3][-1])
+        if pt_map[facename][2] > 0:
+            return ele["to"][axis] == 1
+        return ele["from"][axis] == 0
+
     def _getModel(self, name):
         model, par = ResourceManager().model_loader.getModel("block/" + name)
         if "elements" not in model:
@@ -108,7 +210,10 @@ class BlockBase:
     def build(self):
         raise NotImplementedError("BlockBase._build")
 
-    def _writeElement(self, fout, ele, material):
+    def _writeElement(self, fout, ele, material, culled=0, merged=False):
+        facenames = [f for f in ele["faces"] if not self._isSkipped(ele, f, material, culled, merged)]
+        if not facenames:
+            return
         from_pt = ele["from"]
         to_pt = ele["to"]
         cube = minus(to_pt, from_pt)
@@ -131,10 +236,15 @@ class BlockBase:
                 fout.write("Scale %f %f %f\n" % plus(mult(sxyz[axis], scale), rxyz[axis]))
             fout.write("Translate %f %f %f\n" % org)
 
-        for facename in ele["faces"]:
+        for facename in facenames:
             face = ele["faces"][facename]
             tex = face["texture"]
             uv = face["uv"]
+            tex_name = tex
+            atlas = ResourceManager().atlas
+            if atlas is not None:
+                tex_name, uv = atlas.remap(tex, uv)
+                face = dict(face, texture=tex_name, uv=uv)
             delta_f, l_f, dir_, shape = pt_map[facename]
             delta = delta_f(cube)
             l1, l2 = l_f(cube)
@@ -149,18 +259,22 @@ class BlockBase:
                 material.write(fout, face)
 
             fout.write('  Translate %f %f %f\n' % delta)
-            if ResourceManager().hasAlpha(tex + ".png"):
-                fout.write('  Shape "%s" "float l1" [%f] "float l2" [%f] ' % (shape, l1, l2) +
-                           '  "float dir" [%d] "texture alpha" "%s-alpha"' % (dir_, tex) +
-                           '  "float u0" [%f] "float v0" [%f] "float u1" [%f] "float v1" [%f]\n' % uv)
-            else:
-                fout.write('  Shape "%s" "float l1" [%f] "float l2" [%f] ' % (shape, l1, l2) +
-                           '  "float dir" [%d] ' % (dir_, ) +
-                           '  "float u0" [%f] "float v0" [%f] "float u1" [%f] "float v1" [%f]\n' % uv)
+            BlockBase.writeShape(fout, shape, l1, l2, dir_, tex, tex_name, uv)
             fout.write('AttributeEnd\n')
 
         fout.write('AttributeEnd\n')
 
+    def writeShape(fout, shape, l1, l2, dir_, tex, tex_name, uv):
+        """Write the quad of a face, alpha tested if tex uses alpha"""
+        if ResourceManager().hasAlpha(tex + ".png"):
+            fout.write('  Shape "%s" "float l1" [%f] "float l2" [%f] ' % (shape, l1, l2) +
+                       '  "float dir" [%d] "texture alpha" "%s-alpha"' % (dir_, tex_name) +
+                       '  "float u0" [%f] "float v0" [%f] "float u1" [%f] "float v1" [%f]\n' % uv)
+        else:
+            fout.write('  Shape "%s" "float l1" [%f] "float l2" [%f] ' % (shape, l1, l2) +
+                       '  "float dir" [%d] ' % (dir_, ) +
+                       '  "float u0" [%f] "float v0" [%f] "float u1" [%f] "float v1" [%f]\n' % uv)
+
     def _writeRotate(self, fout, axis, ang):
         org = (.5, .5, .5)
         fout.write("Translate %f %f %f\n" % org)
@@ -176,11 +290,14 @@ class BlockBase:
         fout.write(("Scale %f %f %f\n" % plus(mult(axis_v[axis], s), sixa_v[axis])))
         fout.write("Translate %f %f %f\n" % mult(org, -1))
 
-    def write(self, fout):
+    def write(self, fout, culled=0, merged=False):
         """Write file with pbrt format
         
         Args:
             fout: file object
+            culled: face_bit mask of the sides hidden by neighbours, only
+                used when the block is not rotated.
+            merged: leave out the faces given by meshFaces.
         Returns:
             Number of render block(0 or 1)
         """
@@ -188,6 +305,9 @@ class BlockBase:
         if self.empty():
             return 0
 
+        if self.isRotated():
+            culled, merged = 0, False
+
         fout.write('AttributeBegin\n')
         if "axis" in self.state and self.name != "nether_portal":
             axis = self.state["axis"]
@@ -219,7 +339,7 @@ class BlockBase:
                 elif t["type"] == "scale":
                     self._writeScale(fout, t["axis"], t["value"])
             for ele in model["elements"]:
-                self._writeElement(fout, ele, material)
+                self._writeElement(fout, ele, material, culled, merged)
             for t in transforms[::-1]:
                 if t["type"] == "rotate":
                     self._writeRotate(fout, t["axis"], -t["angle"])
@@ -1,66 +1,252 @@
+import io
+import hashlib
+from collections import deque
+
 from resource import ResourceManager
 from tuple_calculation import plus_i, mult_i
+from util import face_delta, face_bit
+from block.mesher import GreedyMesher
 
 class BlockSolver:
     """Write all solid block in the scene"""
 
-    def __init__(self, block):
+    def __init__(self, block, mesh=False, instance=False):
+        """
+        Args:
+            block: blocks of the scene, indexed [y][z][x].
+            mesh: merge coplanar full-block faces with GreedyMesher.
+            instance: write each distinct block geometry once as a pbrt
+                object and place the blocks with ObjectInstance.
+        """
         self.block = block
+        self.mesh = mesh
+        self.instance = instance
+        # (id(block), culled mask) -> (object name, definition) or None
+        self.objects = {}
+        self.culled = {}
         self.Y = len(self.block)
         self.Z = len(self.block[0])
         self.X = len(self.block[0][0])
         self.used_texture = set()
-        self._preloadUsedTexture()
+        self.visible = None
 
     def _inBlock(self, pt):
         x, y, z = pt
         return x >= 0 and x < self.X and y >= 0 and y < self.Y and z >= 0 and z < self.Z
 
-    def _preloadUsedTexture(self):
+    def prepare(self, start_pt):
+        """Find the visible blocks and the textures they use
+
+        Textures are collected once per distinct block object, blocks
+        created from the same state share one object.
+        """
         print("Preloading used texture...")
+        self.visible = self.traverse(start_pt)
         self.used_texture = set()
-        for x in range(self.X):
-            for y in range(self.Y):
-                for z in range(self.Z):
-                    self.used_texture = self.used_texture | self.block[y][z][x].getUsedTexture()
+        seen = set()
+        for x, y, z in self.visible:
+            b = self.block[y][z][x]
+            if id(b) in seen:
+                continue
+            seen.add(id(b))
+            if not b.empty():
+                self.used_texture |= b.getUsedTexture()
 
-    def write(self, fout, start_pt):
-        print("Writing solid blocks...")
+    def _writeTextures(self, fout):
+        atlas = ResourceManager().atlas
+        if atlas is not None:
+            atlas.writeTextures(fout)
+            return
         for fn in self.used_texture:
             fout.write('Texture "%s-color" "spectrum" "imagemap" "string filename" "%s.png"\n' % (fn, fn))
             if ResourceManager().hasAlpha(fn + ".png"):
                 fout.write('Texture "%s-alpha" "float" "imagemap" "bool alpha" "true" "string filename" "%s.png"\n' % (fn, fn))
 
-        import queue
-        que = queue.Queue()
-        rendered = set()
-        deltas = [(1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, -1, 0), (0, 0, 1), (0, 0, -1)]
-        que.put(start_pt)
-        for delta in deltas:
-            next_pt = plus_i(delta, start_pt)
-            if not self._inBlock(next_pt): continue
-            que.put(next_pt)
+    def traverse(self, start_pt):
+        """Flood fill from start_pt through passable blocks
 
-        cnt = 0
-        while not que.empty():
-            pt = que.get()
-            if not self._inBlock(pt): continue
-            if pt in rendered: continue
-            rendered.add(pt)
+        Cells are numbered (y*Z + z)*X + x; a bytearray marks cells
+        already queued, so every cell enters the deque once. The start
+        point and its neighbours are always visited, even when the start
+        point is solid.
+
+        Returns:
+            Visited points in visiting order.
+        """
+        X, Y, Z = self.X, self.Y, self.Z
+        XZ = X*Z
+        queued = bytearray(X*Y*Z)
+        que = deque()
+        passable = {}
+        visited = []
+
+        sx, sy, sz = start_pt
+        if self._inBlock(start_pt):
+            i = (sy*Z + sz)*X + sx
+            queued[i] = 1
+            que.append(i)
+        for dx, dy, dz in [(1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, -1, 0), (0, 0, 1), (0, 0, -1)]:
+            x, y, z = sx + dx, sy + dy, sz + dz
+            if not self._inBlock((x, y, z)): continue
+            i = (y*Z + z)*X + x
+            if queued[i]: continue
+            queued[i] = 1
+            que.append(i)
+
+        block = self.block
+        popleft, append, visit = que.popleft, que.append, visited.append
+        while que:
+            i = popleft()
+            yz, x = divmod(i, X)
+            y, z = divmod(yz, Z)
+            visit((x, y, z))
+            b = block[y][z][x]
+
+            can_pass = passable.get(id(b))
+            if can_pass is None:
+                can_pass = passable[id(b)] = b.canPass()
+            if not can_pass: continue
+
+            # Same neighbour order as before: +x, -x, +y, -y, +z, -z
+            if x + 1 < X and not queued[i + 1]:
+                queued[i + 1] = 1
+                append(i + 1)
+            if x > 0 and not queued[i - 1]:
+                queued[i - 1] = 1
+                append(i - 1)
+            if y + 1 < Y and not queued[i + XZ]:
+                queued[i + XZ] = 1
+                append(i + XZ)
+            if y > 0 and not queued[i - XZ]:
+                queued[i - XZ] = 1
+                append(i - XZ)
+            if z + 1 < Z and not queued[i + X]:
+                queued[i + X] = 1
+                append(i + X)
+            if z > 0 and not queued[i - X]:
+                queued[i - X] = 1
+                append(i - X)
+        return visited
+
+    def culledFaces(self, pt):
+        """Sides of the block at pt hidden by their neighbour
+
+        Returns:
+            Mask of util.face_bit.
+        """
+        if pt in self.culled:
+            return self.culled[pt]
+        x, y, z = pt
+        b = self.block[y][z][x]
+        culled = 0
+        for facename, (dx, dy, dz) in face_delta.items():
+            nx, ny, nz = x + dx, y + dy, z + dz
+            if not self._inBlock((nx, ny, nz)): continue
+            if self.block[ny][nz][nx].occludes(b):
+                culled |= face_bit[facename]
+        self.culled[pt] = culled
+        return culled
+
+    def _object(self, b, culled):
+        """Object drawing block b with the culled faces, None if b is not instanced
+
+        Area lights are not allowed inside pbrt objects, so blocks with a
+        Light material are always written in place.
+        """
+        key = (id(b), culled)
+        if key not in self.objects:
+            self.objects[key] = None
+            if not b.hasAreaLight():
+                buf = io.StringIO()
+                b.write(buf, culled, self.mesh)
+                definition = buf.getvalue()
+                name = "block-" + hashlib.sha1(definition.encode("utf-8")).hexdigest()[:16]
+                self.objects[key] = (name, definition)
+        return self.objects[key]
+
+    def _visibleObjects(self, pts):
+        """Objects used by the blocks at pts, in order of first use"""
+        objects = {}
+        for pt in pts:
             x, y, z = pt
             b = self.block[y][z][x]
+            if b.empty(): continue
+            culled = self.culledFaces(pt)
+            if (culled or self.mesh) and b.isHidden(culled, self.mesh): continue
+            obj = self._object(b, culled)
+            if obj is not None:
+                objects.setdefault(obj[0], obj[1])
+        return objects
 
-            if not b.empty():
-                fout.write('Translate %d %d %d\n' % pt)
-                cnt += b.write(fout)
-                fout.write('Translate %d %d %d\n' % mult_i(pt, -1))
-
-            if b.canPass():
-                for delta in deltas:
-                    next_pt = plus_i(delta, pt)
-                    if not self._inBlock(next_pt): continue
-                    if next_pt in rendered: continue
-                    que.put(next_pt)
-        print("Render", cnt, "blocks")
+    def objectNames(self, pts):
+        """Sorted names of the objects the blocks at pts are placed with"""
+        return sorted(self._visibleObjects(pts))
+
+    def _writeObjects(self, fout):
+        """Define the objects of every visible block"""
+        objects = self._visibleObjects(self.visible)
+        for name, definition in objects.items():
+            fout.write('ObjectBegin "%s"\n' % name)
+            fout.write(definition)
+            fout.write('ObjectEnd\n')
+        print("Define", len(objects), "block objects")
+
+    def writeBlock(self, fout, pt, offset=(0, 0, 0), mesher=None):
+        """Write the block at pt, translated by pt - offset
 
+        Args:
+            mesher: GreedyMesher taking the faces it can merge.
+        Returns:
+            Number of render block(0 or 1)
+        """
+        x, y, z = pt
+        b = self.block[y][z][x]
+        if b.empty():
+            return 0
+        culled = self.culledFaces(pt)
+        local_pt = plus_i(pt, mult_i(offset, -1))
+        merged = mesher is not None
+        cnt = 0
+        if merged:
+            faces = b.meshFaces(culled)
+            if faces:
+                mesher.add(local_pt, faces)
+                cnt = 1
+        if (culled or merged) and b.isHidden(culled, merged):
+            return cnt
+        obj = self._object(b, culled) if self.instance else None
+        fout.write('Translate %d %d %d\n' % local_pt)
+        if obj is not None:
+            fout.write('ObjectInstance "%s"\n' % obj[0])
+            cnt = 1
+        else:
+            cnt = b.write(fout, culled, merged)
+        fout.write('Translate %d %d %d\n' % mult_i(local_pt, -1))
+        return cnt
+
+    def writeBlocks(self, fout, pts, offset=(0, 0, 0)):
+        """Write the blocks at pts, translated by -offset
+
+        Returns:
+            Number of render blocks
+        """
+        if not self.mesh:
+            return sum(self.writeBlock(fout, pt, offset) for pt in pts)
+        mesher = GreedyMesher()
+        cnt = sum(self.writeBlock(fout, pt, offset, mesher) for pt in pts)
+        mesher.write(fout)
+        return cnt
 
+    def write(self, fout, start_pt, chunk_writer=None):
+        print("Writing solid blocks...")
+        if self.visible is None:
+            self.prepare(start_pt)
+        self._writeTextures(fout)
+        if self.instance:
+            self._writeObjects(fout)
+
+        if chunk_writer is not None:
+            cnt = chunk_writer.write(fout, self)
+        else:
+            cnt = self.writeBlocks(fout, self.visible)
+        print("Render", cnt, "blocks")
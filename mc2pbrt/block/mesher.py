@@ -0,0 +1,88 @@
+import io
+
+from block.block import BlockBase
+from util import pt_map
+
+class GreedyMesher:
+    """Merge coplanar full-block faces into larger quads
+
+    Faces are grouped by side, plane, material and texture, then every
+    group is covered greedily by maximal rectangles of cells. A rectangle
+    of n1*n2 cells is one quad with the texture repeated n1 times along
+    l1 and n2 times along l2; shape u runs along l1 (see the UV swap in
+    ModelLoader._scaleModel).
+    """
+
+    def __init__(self):
+        self.groups = {}
+        self.material_text = {}
+
+    def _materialText(self, material, face):
+        key = (id(material), id(face))
+        if key not in self.material_text:
+            buf = io.StringIO()
+            if material:
+                material.write(buf, face)
+            self.material_text[key] = buf.getvalue()
+        return self.material_text[key]
+
+    def add(self, pt, faces):
+        """Add faces of the block at pt
+
+        Args:
+            pt: position of the block in the output.
+            faces: (facename, face, material) from BlockBase.meshFaces.
+        """
+        for facename, face, material in faces:
+            axis = "xyz".index(pt_map[facename][3][-1])
+            key = (facename, pt[axis], self._materialText(material, face), face["texture"])
+            cell = tuple(c for i, c in enumerate(pt) if i != axis)
+            self.groups.setdefault(key, set()).add(cell)
+
+    def _rectangles(cells):
+        """Cover cells with rectangles, grown from the lowest free cell
+
+        A rectangle first grows along b, then along a as long as the whole
+        row of cells is free.
+
+        Yields:
+            (a, b, na, nb): rectangle of na*nb cells starting at cell (a, b).
+        """
+        used = set()
+        free = lambda cell: cell in cells and cell not in used
+        for a, b in sorted(cells):
+            if (a, b) in used: continue
+            nb = 1
+            while free((a, b + nb)):
+                nb += 1
+            na = 1
+            while all(free((a + na, b + j)) for j in range(nb)):
+                na += 1
+            for i in range(na):
+                for j in range(nb):
+                    used.add((a + i, b + j))
+            yield a, b, na, nb
+
+    def write(self, fout):
+        """Write the merged quads
+
+        Returns:
+            Number of quads.
+        """
+        cnt = 0
+        for key in sorted(self.groups):
+            facename, plane, material_text, tex = key
+            delta_f, l_f, dir_, shape = pt_map[facename]
+            axis = "xyz".index(shape[-1])
+            for a, b, na, nb in GreedyMesher._rectangles(self.groups[key]):
+                center = [a + na/2., b + nb/2.]
+                center.insert(axis, plane + .5 + .5*dir_)
+                # l1 runs along y on quadz faces, along the first cell axis otherwise
+                n1, n2 = (nb, na) if shape == "quadz" else (na, nb)
+                fout.write('AttributeBegin\n')
+                fout.write(material_text)
+                fout.write('  Translate %f %f %f\n' % tuple(center))
+                BlockBase.writeShape(fout, shape, n1, n2, dir_, tex, tex, (0, 0, n1, n2))
+                fout.write('AttributeEnd\n')
+                cnt += 1
+        return cnt
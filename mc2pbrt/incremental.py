@@ -0,0 +1,118 @@
+import os
+import json
+import hashlib
+from array import array
+
+class ChunkIncludeWriter:
+    """Write solid blocks as one pbrt Include file per chunk.
+
+    A manifest next to the chunk files keeps, for every chunk, the region
+    timestamps of the chunk and its four neighbours and a digest of its
+    visible blocks and their culled faces. A chunk file is only written
+    again when one of them changed, so a re-export after a small edit
+    rewrites a few chunks.
+    """
+    VERSION = 2
+    NEIGHBOURS = [(0, 0), (1, 0), (-1, 0), (0, 1), (0, -1)]
+
+    def __init__(self, folder, origin, chunk_stamps, options=None):
+        """
+        Args:
+            folder: folder of chunk files, next to the main pbrt file.
+            origin: world position of block (0, 0, 0) of the scene.
+            chunk_stamps: {(cx, cz): region timestamp} of exported chunks.
+            options: anything else the chunk geometry depends on.
+        """
+        self.folder = folder
+        self.origin = origin
+        self.chunk_stamps = chunk_stamps
+        self.options = dict(options or {}, origin_y=origin[1])
+        self.manifest_fn = os.path.join(folder, "manifest.json")
+
+    def _loadManifest(self):
+        try:
+            with open(self.manifest_fn, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get("version") != ChunkIncludeWriter.VERSION:
+            return {}
+        if manifest.get("options") != self.options:
+            return {}
+        return manifest.get("chunks", {})
+
+    def _saveManifest(self, chunks):
+        manifest = {
+            "version": ChunkIncludeWriter.VERSION,
+            "options": self.options,
+            "chunks": chunks,
+        }
+        with open(self.manifest_fn, "w") as f:
+            json.dump(manifest, f)
+
+    def _stamps(self, chunk):
+        cx, cz = chunk
+        return [self.chunk_stamps.get((cx+dx, cz+dz), 0) for dx, dz in ChunkIncludeWriter.NEIGHBOURS]
+
+    def _blockKind(block):
+        """What a block is, independent of where it is"""
+        return "%s %s %d" % (block.name, json.dumps(block.state, sort_keys=True), block.biome_id)
+
+    def write(self, fout, solver):
+        """Write changed chunk files and include every visible chunk
+
+        Args:
+            fout: main pbrt file object.
+            solver: prepared BlockSolver of the scene.
+        Returns:
+            Number of render blocks.
+        """
+        ox, oy, oz = self.origin
+        chunks = {}
+        for pt in solver.visible:
+            chunks.setdefault(((pt[0]+ox)//16, (pt[2]+oz)//16), []).append(pt)
+
+        os.makedirs(self.folder, exist_ok=True)
+        old_entries = self._loadManifest()
+        entries = {}
+        cnt, rewritten = 0, 0
+        for chunk, pts in sorted(chunks.items()):
+            offset = (chunk[0]*16 - ox, 0, chunk[1]*16 - oz)
+            local = array("i")
+            kinds = {}
+            for pt in pts:
+                x, y, z = pt
+                block = ChunkIncludeWriter._blockKind(solver.block[y][z][x])
+                kind = kinds.setdefault(block, len(kinds))
+                local.extend((x - offset[0], y, z - offset[2], solver.culledFaces(pt), kind))
+            blocks = hashlib.sha1(json.dumps(list(kinds)).encode("utf-8"))
+            blocks.update(local.tobytes())
+
+            key = "%d,%d" % chunk
+            entry = {
+                "stamps": self._stamps(chunk),
+                "blocks": blocks.hexdigest(),
+            }
+            if solver.instance:
+                # Objects are defined in the main file, names follow their content
+                entry["objects"] = solver.objectNames(pts)
+            old_entry = old_entries.get(key, {})
+            chunk_fn = "c.%d.%d.pbrt" % chunk
+            full_fn = os.path.join(self.folder, chunk_fn)
+            if all(old_entry.get(k) == entry[k] for k in entry) and os.path.exists(full_fn):
+                entry["count"] = old_entry["count"]
+            else:
+                with open(full_fn, "w") as cf:
+                    entry["count"] = solver.writeBlocks(cf, pts, offset)
+                rewritten += 1
+            entries[key] = entry
+            cnt += entry["count"]
+
+            fout.write('AttributeBegin\n')
+            fout.write('Translate %d %d %d\n' % offset)
+            fout.write('Include "%s/%s"\n' % (os.path.basename(self.folder), chunk_fn))
+            fout.write('AttributeEnd\n')
+
+        self._saveManifest(entries)
+        print("Rewrite", rewritten, "of", len(chunks), "chunks")
+        return cnt
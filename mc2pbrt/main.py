@@ -42,6 +42,15 @@ if __name__ == "__main__":
         camera = cam,
         method = settings.get("Method", 'path'),
         phenomenons = phs,
+        workers = settings.get("Workers", None),
+        cache_dir = settings.get("Cache", None),
+        incremental = settings.get("Incremental", False),
+        max_chunks = settings.get("MaxChunks", None),
+        max_chunk_bytes = settings.get("MaxChunkMemory", 0)*2**20 or None,
+        player_uuid = settings.get("PlayerUUID", None),
+        atlas = settings.get("Atlas", False),
+        mesh = settings.get("Mesh", False),
+        instance = settings.get("Instance", False),
     )
 
     rc.run(settings.get("Target", "target.pbrt"))
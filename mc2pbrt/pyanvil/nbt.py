@@ -1,4 +1,10 @@
-import struct, sys
+import array, struct, sys
+
+# Precompiled headers shared by the parsers
+_TAG_HEADER = struct.Struct('>BH')
+_LIST_HEADER = struct.Struct('>Bi')
+_USHORT = struct.Struct('>H')
+_INT = struct.Struct('>i')
 
 def write_string(stream, string):
     stream.write(len(string).to_bytes(2, byteorder='big', signed=False))
@@ -17,17 +23,16 @@ def create_simple_nbt_class(tag_id, tag_name, tag_width, tag_parser):
         clazz_width = tag_width
         clazz_name = tag_name
         clazz_parser = tag_parser
+        clazz_struct = struct.Struct(tag_parser)
         clazz_id = tag_id
 
         @classmethod
-        def parse(cls, stream, name):
-            return cls(
-                name, 
-                struct.unpack(
-                    cls.clazz_parser, 
-                    stream.read(cls.clazz_width)
-                )[0]
-            )
+        def parse(cls, stream, name, include=None):
+            return cls(name, stream.unpack(cls.clazz_struct)[0])
+
+        @classmethod
+        def skip(cls, stream):
+            stream.skip(cls.clazz_width)
 
         def __init__(self, tag_name, tag_value):
             self.tag_name = tag_name
@@ -59,11 +64,16 @@ def create_string_nbt_class(tag_id):
         clazz_id = tag_id
 
         @classmethod
-        def parse(cls, stream, name):
-            payload_length = int.from_bytes(stream.read(2), byteorder='big', signed=False)
-            payload = stream.read(payload_length).decode('utf-8')
+        def parse(cls, stream, name, include=None):
+            payload_length, = stream.unpack(_USHORT)
+            payload = str(stream.read(payload_length), 'utf-8')
             return cls(name, payload)
 
+        @classmethod
+        def skip(cls, stream):
+            payload_length, = stream.unpack(_USHORT)
+            stream.skip(payload_length)
+
         def __init__(self, tag_name, tag_value):
             self.tag_name = tag_name
             self.tag_value = tag_value
@@ -96,27 +106,50 @@ def create_array_nbt_class(tag_id, tag_name, sub_type):
         clazz_sub_type = sub_type
         clazz_name = tag_name
         clazz_id = tag_id
+        clazz_typecode = sub_type.clazz_parser[1:]
 
         @classmethod
-        def parse(cls, stream, name):
-            payload_length = int.from_bytes(stream.read(4), byteorder='big', signed=True)
-            tag = cls(name)
-            for i in range(payload_length):
-                tag.add_child(cls.clazz_sub_type.parse(stream, 'None'))
-            return tag
+        def parse(cls, stream, name, include=None):
+            payload_length, = stream.unpack(_INT)
+            values = array.array(cls.clazz_typecode)
+            values.frombytes(stream.read(payload_length * values.itemsize))
+            if sys.byteorder == 'little':
+                values.byteswap()
+            return cls(name, values=values)
 
-        def __init__(self, tag_name, children=[]):
+        @classmethod
+        def skip(cls, stream):
+            payload_length, = stream.unpack(_INT)
+            stream.skip(payload_length * cls.clazz_sub_type.clazz_width)
+
+        def __init__(self, tag_name, children=[], values=None):
             self.tag_name = tag_name
-            self.children = children[:]
+            if values is None:
+                values = array.array(type(self).clazz_typecode, [c.get() for c in children])
+            self.values = values
+            self._children = None
+
+        @property
+        def children(self):
+            # Element tags are only built on request, the payload lives in values
+            if self._children is None:
+                sub = type(self).clazz_sub_type
+                self._children = [sub('None', v) for v in self.values]
+            return self._children
         
         def add_child(self, tag):
-            self.children.append(tag)
+            self.values.append(tag.get())
+            if self._children is not None:
+                self._children.append(tag)
+
+        def get(self):
+            return self.values
 
         def name(self):
             return self.tag_name
 
         def print(self, indent=''):
-            print(indent + type(self).clazz_name + ': ' + self.tag_name + ' size ' + str(len(self.children)))
+            print(indent + type(self).clazz_name + ': ' + self.tag_name + ' size ' + str(len(self.values)))
             for c in self.children:
                 c.print(indent + '  ')
 
@@ -125,10 +158,12 @@ def create_array_nbt_class(tag_id, tag_name, sub_type):
                 stream.write(type(self).clazz_id.to_bytes(1, byteorder='big', signed=False))
                 write_string(stream, self.tag_name)
                 
-            stream.write(len(self.children).to_bytes(4, byteorder='big', signed=True))
+            stream.write(len(self.values).to_bytes(4, byteorder='big', signed=True))
 
-            for tag in self.children:
-                tag.serialize(stream, include_name=False)
+            payload = array.array(type(self).clazz_typecode, self.values)
+            if sys.byteorder == 'little':
+                payload.byteswap()
+            stream.write(payload.tobytes())
 
     register_parser(tag_id, ArrayNBTTag)
 
@@ -140,16 +175,29 @@ def create_list_nbt_class(tag_id):
         clazz_id = tag_id
 
         @classmethod
-        def parse(cls, stream, name):
+        def parse(cls, stream, name, include=None):
             global _parsers
 
-            sub_type = int.from_bytes(stream.read(1), byteorder='big', signed=False)
-            payload_length = int.from_bytes(stream.read(4), byteorder='big', signed=True)
+            sub_type, payload_length = stream.unpack(_LIST_HEADER)
             tag = cls(name, sub_type)
             for i in range(payload_length):
-                tag.add_child(_parsers[sub_type].parse(stream, 'None'))
+                tag.add_child(_parsers[sub_type].parse(stream, 'None', include))
             return tag
 
+        @classmethod
+        def skip(cls, stream):
+            global _parsers
+
+            sub_type, payload_length = stream.unpack(_LIST_HEADER)
+            if payload_length <= 0:
+                return
+            sub_parser = _parsers[sub_type]
+            if hasattr(sub_parser, 'clazz_width'):
+                stream.skip(payload_length * sub_parser.clazz_width)
+            else:
+                for i in range(payload_length):
+                    sub_parser.skip(stream)
+
         def __init__(self, tag_name, sub_type_id, children=[]):
             self.tag_name = tag_name
             self.sub_type_id = sub_type_id
@@ -187,13 +235,34 @@ def create_compund_nbt_class(tag_id):
         clazz_id = tag_id
 
         @classmethod
-        def parse(cls, stream, name):
+        def parse(cls, stream, name, include=None):
+            global _parsers
+
             tag = cls(name)
-            while stream.peek() != 0: # end tag
-                tag.add_child(parse_nbt(stream))
+            if include is None:
+                while stream.peek() != 0: # end tag
+                    tag.add_child(parse_nbt(stream))
+            else:
+                while stream.peek() != 0:
+                    tag_type, tag_name_length = stream.unpack(_TAG_HEADER)
+                    tag_name = str(stream.read(tag_name_length), 'utf-8')
+                    if tag_name in include:
+                        tag.add_child(_parsers[tag_type].parse(stream, tag_name, include[tag_name]))
+                    else:
+                        _parsers[tag_type].skip(stream)
             stream.read(1) # get rid of the end tag
             return tag
 
+        @classmethod
+        def skip(cls, stream):
+            global _parsers
+
+            while stream.peek() != 0:
+                tag_type, tag_name_length = stream.unpack(_TAG_HEADER)
+                stream.skip(tag_name_length)
+                _parsers[tag_type].skip(stream)
+            stream.skip(1)
+
         def __init__(self, tag_name, children=[]):
             self.tag_name = tag_name
             self.children = { c.tag_name: c for c in children[:] }
@@ -253,12 +322,39 @@ CompoundTag = create_compund_nbt_class(10)
 IntArrayTag = create_array_nbt_class(11, 'IntArray', IntTag)
 LongArrayTag = create_array_nbt_class(12, 'LongArray', LongTag)
 
-def parse_nbt(stream):
+def compile_include(paths):
+    """Build the include filter used by parse_nbt.
+
+    Paths are '/' separated tag names relative to the root tag, lists are
+    transparent (e.g. 'Level/Sections/Y' selects Y in every section). The
+    result is a nested dict, None marks a fully included subtree.
+    """
+    include = {}
+    for path in paths:
+        node = include
+        keys = path.split('/')
+        for key in keys[:-1]:
+            if key in node and node[key] is None:
+                break
+            node = node.setdefault(key, {})
+        else:
+            node[keys[-1]] = None
+    return include
+
+def parse_nbt(stream, include=None):
+    """Parse one named tag from stream.
+
+    If include is given (a list of paths or the result of
+    compile_include), subtrees outside of it are skipped by payload
+    length without building any tag objects.
+    """
     global _parsers
 
-    tag_type = int.from_bytes(stream.read(1), byteorder='big', signed=False)
-    tag_name_length = int.from_bytes(stream.read(2), byteorder='big', signed=False)
-    tag_name = stream.read(tag_name_length).decode('utf-8')
+    if include is not None and not isinstance(include, dict):
+        include = compile_include(include)
+
+    tag_type, tag_name_length = stream.unpack(_TAG_HEADER)
+    tag_name = str(stream.read(tag_name_length), 'utf-8')
 
-    return _parsers[tag_type].parse(stream, tag_name)
+    return _parsers[tag_type].parse(stream, tag_name, include)
 
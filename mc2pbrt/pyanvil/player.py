@@ -1,18 +1,37 @@
-import json, gzip
+import os, json, gzip, hashlib, uuid as uuidlib
 import http.client
+import urllib.parse
 
 import pyanvil.nbt as nbt
 import pyanvil.stream as stream
 
 class Player:
-    def __init__(self, world_path, username):
-        uuid = self._username_to_uuid(username)
+    API_URL = "https://api.mojang.com"
+
+    def __init__(self, world_path, username, uuid=None, cache_file=None,
+                 launcher_path=None, api_url=API_URL):
+        """Load a player of a world.
+
+        The UUID is resolved without the network whenever possible, in
+        order: the uuid argument ("offline" for the offline-mode UUID),
+        the usercache.json of the server and of the launcher, the local
+        cache_file, the offline-mode UUID if that player file exists, and
+        only then the Mojang API (whose answer is stored in cache_file).
+        """
+        self.world_path = world_path
+        self.username = username
+        self.cache_file = cache_file
+        self.launcher_path = launcher_path
+        self.api_url = api_url
+
+        uuid = self._resolve_uuid(username, uuid)
         uuid_fn = self._uuid_to_filename(uuid)
         player_path = world_path + '/playerdata/' + uuid_fn + ".dat"
         with gzip.open(player_path, mode='rb') as p:
             in_stream = stream.InputStream(p.read())
             p_data = nbt.parse_nbt(in_stream)
 
+        self.uuid = uuid
         self.pos = [c.get() for c in p_data.get("Pos").children]
         self.rot = [c.get() for c in p_data.get("Rotation").children]
         self.dim = p_data.get("Dimension").get()
@@ -20,24 +39,95 @@ class Player:
     def _uuid_to_filename(self, uuid):
         return "-".join([uuid[:8], uuid[8:12], uuid[12:16], uuid[16:20], uuid[20:]])
 
-    def _username_to_uuid(self, username):
-        """Get the UUID of the player."""
-        get_args = ""
+    def _normalize(self, uuid):
+        return uuid.replace("-", "").lower()
+
+    def _offline_uuid(self, username):
+        """UUID the server gives username in offline mode"""
+        digest = hashlib.md5(("OfflinePlayer:" + username).encode("utf-8")).digest()
+        return uuidlib.UUID(bytes=digest, version=3).hex
+
+    def _has_playerdata(self, uuid):
+        return os.path.exists(os.path.join(self.world_path, "playerdata", self._uuid_to_filename(uuid) + ".dat"))
+
+    def _usercache_files(self):
+        files = [os.path.join(os.path.dirname(os.path.abspath(self.world_path)), "usercache.json")]
+        if self.launcher_path:
+            files.append(os.path.join(self.launcher_path, "usercache.json"))
+        return files
+
+    def _from_usercache(self, username, filename):
+        try:
+            with open(filename, "r") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return None
+        for entry in entries:
+            if isinstance(entry, dict) and entry.get("name", "").lower() == username.lower():
+                return self._normalize(entry["uuid"])
+        return None
+
+    def _load_cache(self):
+        if self.cache_file is None:
+            return {}
+        try:
+            with open(self.cache_file, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_cache(self, username, uuid):
+        if self.cache_file is None:
+            return
+        cache = self._load_cache()
+        cache[username.lower()] = uuid
+        with open(self.cache_file, "w") as f:
+            json.dump(cache, f, indent=2)
+
+    def _resolve_uuid(self, username, uuid=None):
+        """Get the UUID of the player, the network is the last resort."""
+        if uuid == "offline":
+            return self._offline_uuid(username)
+        if uuid:
+            return self._normalize(uuid)
+
+        for filename in self._usercache_files():
+            found = self._from_usercache(username, filename)
+            if found:
+                return found
+
+        cached = self._load_cache().get(username.lower())
+        if cached:
+            return cached
 
-        http_conn = http.client.HTTPSConnection("api.mojang.com")
-        http_conn.request("GET", "/users/profiles/minecraft/" + username + get_args, 
+        offline = self._offline_uuid(username)
+        if self._has_playerdata(offline):
+            return offline
+
+        found = self._username_to_uuid(username)
+        if not found:
+            raise KeyError("Player %s not found." % username)
+        self._save_cache(username, found)
+        return found
+
+    def _username_to_uuid(self, username):
+        """Get the UUID of the player from the Mojang API."""
+        url = urllib.parse.urlsplit(self.api_url)
+        if url.scheme == "http":
+            http_conn = http.client.HTTPConnection(url.netloc, timeout=10)
+        else:
+            http_conn = http.client.HTTPSConnection(url.netloc, timeout=10)
+        http_conn.request("GET", url.path.rstrip("/") + "/users/profiles/minecraft/" + username,
                           headers={'User-Agent':'Minecraft Username -> UUID', 'Content-Type':'application/json'})
         response = http_conn.getresponse().read().decode("utf-8")
+        http_conn.close()
 
-        if not response and timestamp is None: # No response & no timestamp
-            return self.get_uuid(0) # Let's retry with the Unix timestamp 0.
         if not response: # No response (player probably doesn't exist)
             return ""
 
         json_data = json.loads(response)
         try:
-            uuid = json_data['id']
+            return self._normalize(json_data['id'])
         except KeyError as e:
             print("KeyError raised:", e);
-
-        return uuid
+            return ""
@@ -1,13 +1,28 @@
 class InputStream:
+    """Read-only cursor over a buffer.
+
+    The buffer is wrapped in a memoryview so that reads hand out views
+    instead of copies. Fixed-width fields should be decoded with
+    `unpack`, which reads straight from the buffer with a precompiled
+    `struct.Struct`.
+    """
     def __init__(self, data):
         self.pos = 0
-        self.buffer = data
+        self.buffer = memoryview(data)
 
     def read(self, num):
         rtn = self.buffer[self.pos:self.pos + num]
         self.pos = self.pos + num
         return rtn
 
+    def unpack(self, fmt):
+        rtn = fmt.unpack_from(self.buffer, self.pos)
+        self.pos = self.pos + fmt.size
+        return rtn
+
+    def skip(self, num):
+        self.pos = self.pos + num
+
     def peek(self):
         return self.buffer[self.pos]
 
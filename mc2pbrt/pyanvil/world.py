@@ -1,4 +1,6 @@
-import os, sys, math, gzip, zlib, time
+import os, sys, math, gzip, zlib, time, struct, array, mmap, pickle, hashlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 import pyanvil.nbt as nbt
 import pyanvil.stream as stream
@@ -14,9 +16,13 @@ class BlockState:
 
 class Block:
     AIR = None
+    AIR_NAMES = ('minecraft:air', 'minecraft:cave_air', 'minecraft:void_air')
     def __init__(self, state):
         self.state = state
 
+    def is_air(self):
+        return self.state.name in Block.AIR_NAMES
+
     def __str__(self):
         return 'Block(' + str(self.state) + ')'
 
@@ -26,18 +32,128 @@ class Block:
 Block.AIR = Block(BlockState('minecraft:air', {}))
 
 
+# Lookup tables for the 4 bit fast path (low nibble comes first)
+_LOW_NIBBLE = bytes(i & 0xf for i in range(256))
+_HIGH_NIBBLE = bytes(i >> 4 for i in range(256))
+
+def unpack_block_states(long_list, palette_size):
+    """Unpack a BlockStates long array into palette indices
+
+    Handles both the pre-1.16 layout, where an index may span two longs,
+    and the 1.16+ layout, where indices are padded to a long boundary.
+
+    Args:
+        long_list: BlockStates as signed 64 bit integers.
+        palette_size: number of entries in the section palette.
+    Returns:
+        array('H') of 4096 palette indices in yzx order.
+    """
+    if not isinstance(long_list, array.array) or long_list.typecode != 'q':
+        long_list = array.array('q', long_list)
+
+    if (len(long_list) * 64) % 4096 == 0:
+        width = len(long_list) * 64 // 4096
+        spanning = True
+    else:
+        width = max(4, (palette_size - 1).bit_length())
+        spanning = False
+    mask = (1 << width) - 1
+
+    if spanning and width in (4, 8):
+        data = long_list.tobytes()
+        if sys.byteorder == 'big':
+            swapped = array.array('q', long_list)
+            swapped.byteswap()
+            data = swapped.tobytes()
+        # Scatter the entries into the low byte of each uint16
+        low = 0 if sys.byteorder == 'little' else 1
+        wide = bytearray(2*4096)
+        if width == 8:
+            wide[low::2] = data
+        else:
+            wide[low::4] = data.translate(_LOW_NIBBLE)
+            wide[low + 2::4] = data.translate(_HIGH_NIBBLE)
+        states = array.array('H')
+        states.frombytes(wide)
+        return states
+
+    if spanning:
+        # width longs hold exactly 64 entries, join them into one integer
+        data = long_list.tobytes()
+        if sys.byteorder == 'big':
+            swapped = array.array('q', long_list)
+            swapped.byteswap()
+            data = swapped.tobytes()
+        group = 8 * width
+        shifts = range(0, 64 * width, width)
+        words = [int.from_bytes(data[i:i + group], 'little') for i in range(0, len(data), group)]
+    else:
+        shifts = range(0, (64 // width) * width, width)
+        words = long_list
+
+    states = array.array('H', [(word >> shift) & mask for word in words for shift in shifts])
+    del states[4096:]
+    return states
+
+
+def pack_block_states(states, width, spanning):
+    """Pack palette indices into a BlockStates long array
+
+    The inverse of unpack_block_states, for benchmarks and tests.
+
+    Args:
+        states: palette indices in yzx order.
+        width: bits per index.
+        spanning: pre-1.16 layout where an index may span two longs,
+            otherwise indices are padded to a long boundary.
+    Returns:
+        array('q') of signed 64 bit integers.
+    """
+    if spanning:
+        packed = sum(s << (i * width) for i, s in enumerate(states))
+        words = [(packed >> (64 * i)) & ((1 << 64) - 1) for i in range(len(states) * width // 64)]
+    else:
+        per_long = 64 // width
+        words = [sum(s << (j * width) for j, s in enumerate(states[i:i + per_long]))
+                 for i in range(0, len(states), per_long)]
+    return array.array('q', [w - (1 << 64) if w >= 1 << 63 else w for w in words])
+
+
 class ChunkSection:
-    def __init__(self, blocks, raw_section, y_index):
-        self.blocks = blocks
-        self.raw_section = raw_section
+    """16x16x16 blocks stored as a palette and one uint16 index per block"""
+    def __init__(self, palette, states, y_index):
+        # [Block], states[x + z * 16 + y * 16 ** 2] indexes into it
+        self.palette = palette
+        self.states = states
         self.y_index = y_index
+        self._empty = None
+
+    def is_empty(self):
+        """Whether every block of the section is air"""
+        if self._empty is None:
+            air_ids = set(i for i, block in enumerate(self.palette) if block.is_air())
+            if len(air_ids) == len(self.palette):
+                self._empty = True
+            elif not air_ids:
+                self._empty = False
+            else:
+                self._empty = set(self.states) <= air_ids
+        return self._empty
+
+    @property
+    def blocks(self):
+        palette = self.palette
+        return [palette[state] for state in self.states]
 
     def get_block(self, block_pos):
+        return self.palette[self.get_state(block_pos)]
+
+    def get_state(self, block_pos):
         x = block_pos[0]
         y = block_pos[1]
         z = block_pos[2]
 
-        return self.blocks[x + z * 16 + y * 16 ** 2]
+        return self.states[x + z * 16 + y * 16 ** 2]
 
 
 class Chunk:
@@ -48,26 +164,29 @@ class Chunk:
         
     def _build(self, raw_nbt):
         sections = {}
+        if raw_nbt is None:
+            self.sections = sections
+            self.biome_table = array.array('i', bytes(4*256))
+            return
         level_node = raw_nbt.get('Level')
         for section in level_node.get('Sections').children:
-            flatstates = [c.get() for c in section.get('BlockStates').children]
-            pack_size = int((len(flatstates) * 64) / (16**3))
-            states = [
-                Chunk._read_width_from_loc(flatstates, pack_size, i) for i in range(16**3)
-            ]
+            if not section.has('BlockStates'):
+                # Light-only section
+                continue
+            states = unpack_block_states(
+                section.get('BlockStates').values,
+                len(section.get('Palette').children)
+            )
             palette = [ 
-                BlockState(
+                Block(BlockState(
                     state.get('Name').get(),
                     state.get('Properties').to_dict() if state.has('Properties') else {}
-                ) for state in section.get('Palette').children
-            ]
-            blocks = [
-                Block(palette[state]) for state in states
+                )) for state in section.get('Palette').children
             ]
-            sections[section.get('Y').get()] = ChunkSection(blocks, section, section.get('Y').get())
+            sections[section.get('Y').get()] = ChunkSection(palette, states, section.get('Y').get())
 
         self.sections = sections
-        self.biome_table = [b.get() for b in level_node.get('Biomes').children]
+        self.biome_table = level_node.get('Biomes').values
 
     def _read_width_from_loc(long_list, width, possition):
         offset = possition * width
@@ -98,6 +217,40 @@ class Chunk:
 
         return comp
 
+    def to_compact(self):
+        """Plain tuples and bytes describing the chunk, cheap to pickle"""
+        sections = [
+            (
+                y,
+                [(b.state.name, b.state.props) for b in section.palette],
+                section.states.tobytes()
+            ) for y, section in self.sections.items()
+        ]
+        return (self.xpos, self.zpos, self.biome_table.tobytes(), sections)
+
+    @classmethod
+    def from_compact(cls, compact):
+        xpos, zpos, biome_table, sections = compact
+        chunk = cls(xpos, zpos, None)
+        chunk.biome_table = array.array('i')
+        chunk.biome_table.frombytes(biome_table)
+        for y, palette, states in sections:
+            section_states = array.array('H')
+            section_states.frombytes(states)
+            chunk.sections[y] = ChunkSection(
+                [Block(BlockState(name, props)) for name, props in palette],
+                section_states,
+                y
+            )
+        return chunk
+
+    def nbytes(self):
+        """Rough memory footprint of the chunk in bytes"""
+        size = 1024 + len(self.biome_table) * self.biome_table.itemsize
+        for section in self.sections.values():
+            size += 256 + len(section.states) * section.states.itemsize + 256 * len(section.palette)
+        return size
+
     def get_block(self, block_pos):
         return self.get_section(block_pos[1]).get_block([n % 16 for n in block_pos])
 
@@ -106,25 +259,267 @@ class Chunk:
         x = block_pos[0]%16
         return self.biome_table[z*16 + x]
 
+    def get_column(self, x, z, y_min, y_max):
+        """Blocks of one column from y_min to y_max (inclusive) and its biome"""
+        column = (z % 16) * 16 + x % 16
+        blocks = []
+        for key in range(y_min // 16, y_max // 16 + 1):
+            section = self.sections.get(key, Chunk.EMPTY_SECTION)
+            lo = max(y_min, key * 16) - key * 16
+            hi = min(y_max, key * 16 + 15) - key * 16
+            palette = section.palette
+            blocks += [palette[state] for state in section.states[column + lo * 256:column + hi * 256 + 1:256]]
+        return blocks, self.biome_table[column]
+
     def get_section(self, y):
         key = int(y/16)
         if key not in self.sections:
-            self.sections[key] = ChunkSection(
-                [Block.AIR]*4096,
-                nbt.CompoundTag('None'),
-                key
-            )
+            # Shared, never stored in the chunk
+            return Chunk.EMPTY_SECTION
         return self.sections[key]
 
+    def get_y_range(self):
+        """(lowest, highest) y of the non-empty sections, None if all are empty"""
+        keys = [key for key, section in self.sections.items() if not section.is_empty()]
+        if not keys:
+            return None
+        return (min(keys) * 16, max(keys) * 16 + 15)
+
     def __str__(self):
         return "Chunk(" + str(self.xpos) + "," + str(self.zpos) + ")"
 
 
+Chunk.EMPTY_SECTION = ChunkSection([Block.AIR], array.array('H', bytes(2*4096)), None)
+
+
+class BlockBox:
+    """Dense block volume returned by World.get_blocks_box
+
+    states holds one id into palette per block at
+    ((y * size_z) + z) * size_x + x, relative to min_pt. biomes holds one
+    biome id per column at z * size_x + x. Id 0 is always air.
+    """
+    def __init__(self, min_pt, size, palette, states, biomes):
+        self.min_pt = min_pt
+        self.size = size
+        self.palette = palette
+        self.states = states
+        self.biomes = biomes
+
+    def index(self, pt):
+        x, y, z = pt
+        return (y * self.size[2] + z) * self.size[0] + x
+
+    def get_block(self, pt):
+        return self.palette[self.states[self.index(pt)]]
+
+    def get_biome(self, pt):
+        return self.biomes[pt[2] * self.size[0] + pt[0]]
+
+
+class Region:
+    """Anvil region file with its location and timestamp tables parsed once"""
+    HEADER = struct.Struct('>1024I')
+    CHUNK_HEADER = struct.Struct('>IB')
+    SECTOR = 4096
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.file = open(file_name, mode='rb')
+        self.mtime = os.fstat(self.file.fileno()).st_mtime_ns
+        self._parse_header(self.file.read(2*Region.SECTOR))
+
+    def _parse_header(self, header):
+        if len(header) < 2*Region.SECTOR:
+            # Empty or truncated region, treat every chunk as missing
+            header = bytes(2*Region.SECTOR)
+        # (sector offset, sector count) of each chunk
+        self.locations = [(loc >> 8, loc & 0xff) for loc in Region.HEADER.unpack_from(header, 0)]
+        self.timestamps = Region.HEADER.unpack_from(header, Region.SECTOR)
+
+    def _index(self, chunk_pos):
+        return (chunk_pos[0] % 32) + (chunk_pos[1] % 32) * 32
+
+    def has_chunk(self, chunk_pos):
+        return self.locations[self._index(chunk_pos)][0] != 0
+
+    def get_timestamp(self, chunk_pos):
+        return self.timestamps[self._index(chunk_pos)]
+
+    def read_chunk(self, chunk_pos):
+        """Decompressed nbt payload of chunk_pos, None if it is not stored"""
+        sector, count = self.locations[self._index(chunk_pos)]
+        if sector == 0:
+            return None
+        return self._read_payload(sector, count)
+
+    def _read_payload(self, sector, count):
+        self.file.seek(sector*Region.SECTOR)
+        data = self.file.read(count*Region.SECTOR)
+        return Region._decompress(memoryview(data), 0, count)
+
+    def _decompress(data, offset, count):
+        # The payload never crosses the sectors reserved in the location table
+        datalen, compr = Region.CHUNK_HEADER.unpack_from(data, offset)
+        end = min(offset + 4 + datalen, offset + count*Region.SECTOR)
+        payload = data[offset + Region.CHUNK_HEADER.size:end]
+        if compr == 1:
+            return zlib.decompress(payload, 16 + zlib.MAX_WBITS)
+        return zlib.decompress(payload)
+
+    def close(self):
+        self.file.close()
+
+
+class MappedRegion(Region):
+    """Region file read through a read-only memory map.
+
+    Payloads are handed to zlib as slices of the mapping, so reading a
+    chunk costs no seek/read calls, and processes reading the same region
+    share its pages.
+    """
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.file = open(file_name, mode='rb')
+        self.mtime = os.fstat(self.file.fileno()).st_mtime_ns
+        self.map = None
+        self.view = None
+        if os.fstat(self.file.fileno()).st_size >= 2*Region.SECTOR:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.map)
+            self._parse_header(self.view[:2*Region.SECTOR])
+        else:
+            self._parse_header(b'')
+
+    def _read_payload(self, sector, count):
+        return Region._decompress(self.view, sector*Region.SECTOR, count)
+
+    def close(self):
+        if self.map is not None:
+            self.view.release()
+            self.map.close()
+        self.file.close()
+
+
+class ChunkCache:
+    """On-disk cache of decoded chunks (Chunk.to_compact tuples).
+
+    Every entry is stored with the chunk's region timestamp and the region
+    file mtime, and is only used while both still match. Bump VERSION
+    whenever the decoded data can change for the same region file, e.g.
+    the compact layout, CHUNK_INCLUDE or unpack_block_states.
+    """
+    VERSION = 1
+
+    def __init__(self, cache_dir, world_path):
+        world_key = hashlib.sha1(os.path.abspath(world_path).encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(cache_dir, world_key)
+
+    def _file(self, chunk_pos):
+        region_dir = 'r.%d.%d' % (chunk_pos[0] // 32, chunk_pos[1] // 32)
+        return os.path.join(self.path, region_dir, 'c.%d.%d.pickle' % chunk_pos)
+
+    def load(self, chunk_pos, key):
+        try:
+            with open(self._file(chunk_pos), 'rb') as f:
+                cached_key, compact = pickle.load(f)
+        except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+            return None
+        if cached_key != (ChunkCache.VERSION, key):
+            return None
+        return compact
+
+    def store(self, chunk_pos, key, compact):
+        file_name = self._file(chunk_pos)
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        # Write then rename so that readers never see a partial entry
+        temp_name = '%s.%d.tmp' % (file_name, os.getpid())
+        with open(temp_name, 'wb') as f:
+            pickle.dump(((ChunkCache.VERSION, key), compact), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_name, file_name)
+
+
+class ChunkLRU:
+    """Loaded chunks, bounded by a number of chunks and/or bytes.
+
+    Least recently used chunks are evicted first. None means unbounded.
+    """
+    def __init__(self, max_chunks=None, max_bytes=None):
+        self.max_chunks = max_chunks
+        self.max_bytes = max_bytes
+        self.data = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, chunk_pos):
+        return chunk_pos in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, chunk_pos):
+        chunk = self.data[chunk_pos]
+        self.data.move_to_end(chunk_pos)
+        return chunk
+
+    def get(self, chunk_pos):
+        """Chunk at chunk_pos or None, counted as a hit or a miss"""
+        if chunk_pos not in self.data:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self[chunk_pos]
+
+    def __setitem__(self, chunk_pos, chunk):
+        if chunk_pos in self.data:
+            self.nbytes -= self.data[chunk_pos].nbytes()
+        self.data[chunk_pos] = chunk
+        self.data.move_to_end(chunk_pos)
+        self.nbytes += chunk.nbytes()
+        self._evict()
+
+    def _evict(self):
+        # The newest chunk always stays
+        while len(self.data) > 1 and (
+                (self.max_chunks is not None and len(self.data) > self.max_chunks) or
+                (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+            chunk_pos, chunk = self.data.popitem(last=False)
+            self.nbytes -= chunk.nbytes()
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            'chunks': len(self.data),
+            'bytes': self.nbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
 class World:
-    def __init__(self, file_name, save_location=''):
+    # The only parts of a chunk that are read, everything else is skipped
+    CHUNK_INCLUDE = nbt.compile_include([
+        'Level/xPos',
+        'Level/zPos',
+        'Level/Biomes',
+        'Level/Sections/Y',
+        'Level/Sections/Palette',
+        'Level/Sections/BlockStates',
+    ])
+
+    def __init__(self, file_name, save_location='', use_mmap=True, cache_dir=None,
+                 max_chunks=None, max_bytes=None):
         self.file_name = file_name
         self.save_location = save_location
-        self.chunks = {}
+        self.use_mmap = use_mmap
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = ChunkCache(cache_dir, os.path.join(save_location, file_name))
+        self.chunks = ChunkLRU(max_chunks, max_bytes)
+        self.regions = {}
 
     def get_block(self, block_pos):
         chunk_pos = self._get_chunk(block_pos)
@@ -136,32 +531,232 @@ class World:
         chunk = self.get_chunk(chunk_pos)
         return chunk.get_biome(block_pos)
 
+    def get_column(self, x, z, y_min, y_max):
+        """Blocks from (x, y_min, z) to (x, y_max, z) and the column biome in one lookup
+
+        Returns:
+            ([Block] bottom to top, biome id)
+        """
+        return self.get_chunk((x // 16, z // 16)).get_column(x, z, y_min, y_max)
+
+    def get_blocks_box(self, min_pt, max_pt, min_top=None):
+        """Extract every block in a box at once.
+
+        The box is copied section by section with slice assignments, so the
+        cost does not depend on per-block lookups.
+
+        Args:
+            min_pt: (x, y, z) of the lowest corner.
+            max_pt: (x, y, z) of the highest corner, inclusive.
+            min_top: if given, the box is cut above the highest non-empty
+                section of its chunks, but not below min_top. The range is
+                found in the same pass, so every chunk is only loaded once.
+        Returns:
+            BlockBox of the blocks and column biomes.
+        """
+        x0, y0, z0 = min_pt
+        x1, y1, z1 = max_pt
+        sx, sz = x1 - x0 + 1, z1 - z0 + 1
+
+        palette = [Block.AIR]
+        palette_ids = {(Block.AIR.state.name, ()): 0}
+        # One array per section layer of the box, layers left empty stay air
+        layers = {}
+        biomes = array.array('i', bytes(4 * sx * sz))
+        top = y0
+
+        for cx in range(x0 // 16, x1 // 16 + 1):
+            bx0, bx1 = max(x0, cx * 16), min(x1, cx * 16 + 15)
+            n = bx1 - bx0 + 1
+            for cz in range(z0 // 16, z1 // 16 + 1):
+                bz0, bz1 = max(z0, cz * 16), min(z1, cz * 16 + 15)
+                chunk = self.get_chunk((cx, cz))
+
+                for z in range(bz0, bz1 + 1):
+                    src = (z - cz * 16) * 16 + bx0 - cx * 16
+                    dst = (z - z0) * sx + bx0 - x0
+                    biomes[dst:dst + n] = chunk.biome_table[src:src + n]
+
+                for key, section in chunk.sections.items():
+                    if section.is_empty():
+                        # Already air
+                        continue
+                    top = max(top, key * 16 + 15)
+                    by0, by1 = max(y0, key * 16), min(y1, key * 16 + 15)
+                    if by0 > by1:
+                        continue
+                    if key not in layers:
+                        layers[key] = array.array('H', bytes(2 * (by1 - by0 + 1) * sz * sx))
+                    layer = layers[key]
+
+                    # Section palette -> box palette
+                    lut = []
+                    for block in section.palette:
+                        state_key = (block.state.name, tuple(sorted(block.state.props.items())))
+                        if state_key not in palette_ids:
+                            palette_ids[state_key] = len(palette)
+                            palette.append(block)
+                        lut.append(palette_ids[state_key])
+                    local = array.array('H', map(lut.__getitem__, section.states))
+
+                    for y in range(by0, by1 + 1):
+                        for z in range(bz0, bz1 + 1):
+                            src = ((y - key * 16) * 16 + z - cz * 16) * 16 + bx0 - cx * 16
+                            dst = ((y - by0) * sz + z - z0) * sx + bx0 - x0
+                            layer[dst:dst + n] = local[src:src + n]
+
+        if min_top is not None:
+            y1 = min(y1, max(top, min_top))
+        sy = y1 - y0 + 1
+
+        states = array.array('H')
+        for key in range(y0 // 16, y1 // 16 + 1):
+            count = (min(y1, key * 16 + 15) - max(y0, key * 16) + 1) * sz * sx
+            if key in layers:
+                states += layers.pop(key)[:count]
+            else:
+                states.frombytes(bytes(2 * count))
+
+        return BlockBox(tuple(min_pt), (sx, sy, sz), palette, states, biomes)
+
+    def get_y_range(self, chunk_positions):
+        """(lowest, highest) y holding any non-air block in the chunks, None if all air"""
+        ranges = [self.get_chunk(pos).get_y_range() for pos in chunk_positions]
+        ranges = [r for r in ranges if r is not None]
+        if not ranges:
+            return None
+        return (min(r[0] for r in ranges), max(r[1] for r in ranges))
+
     def get_chunk(self, chunk_pos):
-        if chunk_pos not in self.chunks:
-            self._load_chunk(chunk_pos)
+        chunk = self.chunks.get(chunk_pos)
+        if chunk is None:
+            chunk = self._load_chunk(chunk_pos)
 
-        return self.chunks[chunk_pos]
+        return chunk
+
+    def prefetch(self, chunk_positions, workers=None):
+        """Load chunks in parallel across a pool of worker processes.
+
+        Workers decompress and decode whole batches of chunks from one
+        region and send back Chunk.to_compact() tuples, never tag trees.
+
+        Decoded chunks only go into the chunk cache, read them with
+        get_chunk. Ask for no more chunks than max_chunks and max_bytes
+        allow: the cache would evict the earlier ones again, and they
+        would be decoded a second time when they are read.
+
+        Args:
+            chunk_positions: iterable of (x, z) chunk positions.
+            workers: number of processes, defaults to the cpu count.
+        """
+        chunk_positions = list(chunk_positions)
+        todo = sorted(set(pos for pos in chunk_positions if pos not in self.chunks))
+        todo = [pos for pos in todo if not self._load_cached(pos)]
+        workers = workers or os.cpu_count() or 1
+
+        by_region = {}
+        for pos in todo:
+            by_region.setdefault(self._get_region(pos), []).append(pos)
+
+        # A few batches per worker keeps the pool balanced
+        batch = max(1, math.ceil(len(todo) / (workers * 4)))
+        locations, batches = [], []
+        for region_pos, positions in by_region.items():
+            for i in range(0, len(positions), batch):
+                locations.append(self._region_location(region_pos))
+                batches.append(positions[i:i + batch])
+
+        if workers == 1 or len(batches) <= 1:
+            results = map(_decode_chunks, locations, batches, [self.use_mmap] * len(batches))
+            for decoded in results:
+                self._add_compact(decoded)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = pool.map(_decode_chunks, locations, batches, [self.use_mmap] * len(batches))
+                for decoded in results:
+                    self._add_compact(decoded)
+
+    def _add_compact(self, decoded):
+        for pos, compact in decoded:
+            self.chunks[pos] = Chunk.from_compact(compact)
+            self._store_cached(pos, compact)
+
+    def _cache_key(self, chunk_pos):
+        region = self.get_region(self._get_region(chunk_pos))
+        if region is None or not region.has_chunk(chunk_pos):
+            return None
+        return (region.get_timestamp(chunk_pos), region.mtime)
+
+    def _load_cached(self, chunk_pos):
+        """Load chunk_pos from the on-disk cache, True on a hit"""
+        if self.cache is None:
+            return False
+        key = self._cache_key(chunk_pos)
+        compact = self.cache.load(chunk_pos, key) if key is not None else None
+        if compact is None:
+            return False
+        self.chunks[chunk_pos] = Chunk.from_compact(compact)
+        return True
+
+    def _store_cached(self, chunk_pos, compact):
+        if self.cache is None:
+            return
+        key = self._cache_key(chunk_pos)
+        if key is not None:
+            self.cache.store(chunk_pos, key, compact)
+
+    def get_region(self, region_pos):
+        """Region file containing region_pos, opened once and kept open.
+
+        Returns None if the region file does not exist.
+        """
+        if region_pos not in self.regions:
+            region_location = self._region_location(region_pos)
+            if not os.path.exists(region_location):
+                self.regions[region_pos] = None
+            elif self.use_mmap:
+                self.regions[region_pos] = MappedRegion(region_location)
+            else:
+                self.regions[region_pos] = Region(region_location)
+        return self.regions[region_pos]
+
+    def get_timestamp(self, chunk_pos):
+        region = self.get_region(self._get_region(chunk_pos))
+        if region is None:
+            return 0
+        return region.get_timestamp(chunk_pos)
+
+    def close(self):
+        for region in self.regions.values():
+            if region is not None:
+                region.close()
+        self.regions = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
     def _load_chunk(self, chunk_pos):
-        import os
-        chunk_location = os.path.join(self.save_location, self.file_name, "region", self._get_region_file(chunk_pos))
-        with open(chunk_location, mode='rb') as region:
-            locations = [[
-                        int.from_bytes(region.read(3), byteorder='big', signed=False) * 4096, 
-                        int.from_bytes(region.read(1), byteorder='big', signed=False) * 4096
-                    ] for i in range(1024) ]
-
-            timestamps = region.read(4096)
-
-            chunk = self._load_binary_chunk_at(region, locations[((chunk_pos[0] % 32) + (chunk_pos[1] % 32) * 32)][0])
-            self.chunks[chunk_pos] = chunk
-
-    def _load_binary_chunk_at(self, region_file, offset):
-        region_file.seek(offset)
-        datalen = int.from_bytes(region_file.read(4), byteorder='big', signed=False)
-        compr = region_file.read(1)
-        decompressed = zlib.decompress(region_file.read(datalen))
-        data = nbt.parse_nbt(stream.InputStream(decompressed))
+        if self._load_cached(chunk_pos):
+            return self.chunks[chunk_pos]
+        region = self.get_region(self._get_region(chunk_pos))
+        chunk = World._load_region_chunk(region, chunk_pos)
+        self.chunks[chunk_pos] = chunk
+        if self.cache is not None:
+            self._store_cached(chunk_pos, chunk.to_compact())
+        return chunk
+
+    def _load_region_chunk(region, chunk_pos):
+        decompressed = region.read_chunk(chunk_pos) if region is not None else None
+        if decompressed is None:
+            # Chunk was never generated
+            return Chunk(chunk_pos[0], chunk_pos[1], None)
+        return World._load_binary_chunk(decompressed)
+
+    def _load_binary_chunk(decompressed):
+        data = nbt.parse_nbt(stream.InputStream(decompressed), World.CHUNK_INCLUDE)
         chunk_pos = (data.get('Level').get('xPos').get(), data.get('Level').get('zPos').get())
         chunk = Chunk(
             chunk_pos[0],
@@ -170,11 +765,25 @@ class World:
         )
         return chunk
 
-    def _get_region_file(self, chunk_pos):
-        return 'r.' + '.'.join([str(x) for x in self._get_region(chunk_pos)]) + '.mca'
+    def _region_location(self, region_pos):
+        return os.path.join(self.save_location, self.file_name, "region", 'r.%d.%d.mca' % region_pos)
 
     def _get_chunk(self, block_pos):
         return (math.floor(block_pos[0] / 16), math.floor(block_pos[2] / 16))
 
     def _get_region(self, chunk_pos):
         return (math.floor(chunk_pos[0] / 32), math.floor(chunk_pos[1] / 32))
+
+
+def _decode_chunks(region_location, chunk_positions, use_mmap=True):
+    """Worker side of World.prefetch, decode a batch of chunks of one region"""
+    region = None
+    if os.path.exists(region_location):
+        region = MappedRegion(region_location) if use_mmap else Region(region_location)
+    try:
+        return [
+            (pos, World._load_region_chunk(region, pos).to_compact()) for pos in chunk_positions
+        ]
+    finally:
+        if region is not None:
+            region.close()
@@ -10,13 +10,16 @@ from pyanvil.player import Player
 from scene import Scene
 from block import BlockCreator
 
-from util import tqdmpos
+from tqdm import tqdm
 
 class RealCam:
     """Produce a scene with radius"""
 
     def __init__(self, world_name, player_name, radius, samples,
-                       camera, phenomenons, method):
+                       camera, phenomenons, method, workers=None, cache_dir=None,
+                       incremental=False, max_chunks=None, max_chunk_bytes=None,
+                       player_uuid=None, atlas=False, mesh=False,
+                       instance=False):
         # World an be a full path or a world folder name
         if os.path.exists(world_name):
             world_path = world_name 
@@ -27,7 +30,12 @@ class RealCam:
                 raise FileNotFoundError(errno.ENOENT, "World not found.")
         print("Get world:", world_path)
         self.world_path = world_path
-        self.player = Player(self.world_path, player_name) 
+        try:
+            launcher_path = find_minecraft.getMinecraftFolder()
+        except FileNotFoundError:
+            launcher_path = None
+        self.player = Player(self.world_path, player_name, uuid=player_uuid,
+                             cache_file="uuid_cache.json", launcher_path=launcher_path)
 
         # parameters of scene 
         self.radius = radius
@@ -35,6 +43,14 @@ class RealCam:
         self.camera = camera
         self.phenomenons = phenomenons
         self.method = method
+        self.workers = workers
+        self.cache_dir = cache_dir
+        self.incremental = incremental
+        self.max_chunks = max_chunks
+        self.max_chunk_bytes = max_chunk_bytes
+        self.atlas = atlas
+        self.mesh = mesh
+        self.instance = instance
 
     def _getBlocks(self):
         """Get blocks by radius"""
@@ -43,26 +59,54 @@ class RealCam:
         dim_path = self.world_path
         if self.player.dim != 0:
             dim_path = os.path.join(self.world_path, "DIM%d" % self.player.dim)
-        world = World(dim_path)
 
         r = self.radius
         sz = 2*r+1
-        ys = list(range(1, 256))
-        arr = [[[None]*sz for i in range(sz)] for j in ys]
-        dv = range(-r, r+1)
 
         isx, isy, isz = map(int, self.player.pos)
 
-        # check origin point
-        origin = world.get_block((isx, isy, isz)).state.name[10:]
-        if origin.find("air") == -1:
-            print("[Warning] Origin point is not empty.")
-
-        for y, dx, dz in tqdmpos(ys, dv, dv):
-            bs = world.get_block((isx+dx, y, isz+dz)).state
-            biome_id = world.get_biome((isx+dx, y, isz+dz))
-            name = bs.name[10:]
-            arr[y-ys[0]][r + dz][r + dx] = BlockCreator()(name, bs.props, biome_id)
+        chunk_positions = [
+            (cx, cz)
+            for cx in range((isx-r)//16, (isx+r)//16 + 1)
+            for cz in range((isz-r)//16, (isz+r)//16 + 1)
+        ]
+
+        with World(dim_path, cache_dir=self.cache_dir,
+                   max_chunks=self.max_chunks, max_bytes=self.max_chunk_bytes) as world:
+            # check origin point
+            origin = world.get_block((isx, isy, isz)).state.name[10:]
+            if origin.find("air") == -1:
+                print("[Warning] Origin point is not empty.")
+
+            # Decode every chunk in range up front across processes,
+            # unless they would not fit in the chunk cache anyway.
+            # The chunk of the player stands in for the size of the others.
+            estimate = world.get_chunk((isx//16, isz//16)).nbytes() * len(chunk_positions)
+            if ((self.max_chunks is None or len(chunk_positions) <= self.max_chunks) and
+                    (self.max_chunk_bytes is None or estimate <= self.max_chunk_bytes)):
+                world.prefetch(chunk_positions, workers=self.workers)
+
+            # Nothing above the highest non-empty section (or the player) is scanned
+            box = world.get_blocks_box((isx-r, 1, isz-r), (isx+r, 255, isz+r), min_top=isy+2)
+            ys = list(range(box.min_pt[1], box.min_pt[1] + box.size[1]))
+            self.origin = box.min_pt
+            self.chunk_stamps = {pos: world.get_timestamp(pos) for pos in chunk_positions}
+            print("Chunk cache:", world.chunks.stats())
+
+        # Only one BlockCreator call per distinct (state, biome)
+        created = {}
+        def create(state_id, biome_id):
+            key = (state_id, biome_id)
+            if key not in created:
+                bs = box.palette[state_id].state
+                created[key] = BlockCreator()(bs.name[10:], bs.props, biome_id)
+            return created[key]
+
+        arr = [[None]*sz for j in ys]
+        for j in tqdm(range(len(ys)), ascii=True):
+            for k in range(sz):
+                row = box.index((0, j, k))
+                arr[j][k] = list(map(create, box.states[row:row+sz], box.biomes[k*sz:(k+1)*sz]))
 
         return arr
 
@@ -86,5 +130,12 @@ class RealCam:
         scene.phenomenons = self.phenomenons
         scene.method = (self.method, "")
 
+        scene.incremental = self.incremental
+        scene.origin = self.origin
+        scene.chunk_stamps = self.chunk_stamps
+        scene.atlas = self.atlas
+        scene.mesh = self.mesh
+        scene.instance = self.instance
+
         scene_path = os.path.join(ResourceManager().scene_folder, target)
         scene.write(scene_path)
@@ -1,101 +1,324 @@
 import os
 import shutil
-import tempfile
 import zipfile
 import json
+import zlib
+import copy
+import pickle
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from types import MappingProxyType
 from tqdm import tqdm
-from PIL import Image
+from PIL import Image, ImageStat
 
 from tuple_calculation import mult 
 from find_minecraft import getMinecraftFolder
 from util import singleton
 
+def _selectMembers(vzip, prefix, dest_folder, suffix=""):
+    """List (ZipInfo, destination) of files directly under prefix"""
+    members = []
+    for info in vzip.infolist():
+        name = info.filename
+        if not name.startswith(prefix) or info.is_dir():
+            continue
+        filename = name[len(prefix):]
+        if "/" in filename or not filename.endswith(suffix):
+            continue
+        members.append((info, os.path.join(dest_folder, filename)))
+    return members
+
+def _fileCRC(filename):
+    """CRC32 of a file, as stored in zip archives"""
+    crc = 0
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+def _extractMembers(version_file, members, workers):
+    """Stream members of the jar to their destination
+
+    ZipFile objects are not safe to share between threads, so every
+    thread opens the jar once and keeps it for all of its members.
+    """
+    local = threading.local()
+    opened = []
+    lock = threading.Lock()
+
+    def extract(member):
+        if not hasattr(local, "vzip"):
+            local.vzip = zipfile.ZipFile(version_file, 'r')
+            with lock:
+                opened.append(local.vzip)
+        info, dest = member
+        with local.vzip.open(info.filename) as src, open(dest, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+
+    try:
+        if workers is None or workers > 1:
+            with ThreadPoolExecutor(workers) as pool:
+                for _ in tqdm(pool.map(extract, members), total=len(members), ascii=True):
+                    pass
+        else:
+            for member in tqdm(members, ascii=True):
+                extract(member)
+    finally:
+        for vzip in opened:
+            vzip.close()
+
+def _textureInfo(filename):
+    """Read the metadata kept in the texture index for one image file"""
+    with Image.open(filename) as image:
+        width, height = image.size
+        has_band = "A" in image.getbands() or "transparency" in image.info
+        rgba = image.convert("RGBA")
+
+    alpha = rgba.getchannel("A")
+    alpha_used = has_band and alpha.getextrema()[0] < 255
+    # Average colour of the visible texels only
+    mask = alpha if alpha.getextrema()[1] > 0 else None
+    color = ImageStat.Stat(rgba.convert("RGB"), mask).mean
+
+    frames = 1
+    if os.path.exists(filename + ".mcmeta") and height > width and height % width == 0:
+        frames = height // width
+
+    return {
+        "alpha": alpha_used,
+        "size": [width, height],
+        "frames": frames,
+        "color": [round(c / 255., 4) for c in color],
+    }
+
+class TextureIndex:
+    """Persistent metadata of every texture image
+
+    Images are read once, in parallel, when the index is built. Entries
+    are keyed by filename relative to the scene folder and remember the
+    size and mtime of their file, so only new or changed images are read
+    again on later runs.
+    """
+
+    def __init__(self, scene_folder, index_fn):
+        self.scene_folder = scene_folder
+        self.index_fn = index_fn
+        self.entries = {}
+        try:
+            with open(index_fn, "r") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def _stat(self, texture_fn):
+        st = os.stat(os.path.join(self.scene_folder, texture_fn))
+        return [st.st_size, st.st_mtime_ns]
+
+    def update(self, texture_fns, workers=None):
+        """Read the images of texture_fns which are missing or stale
+
+        Args:
+            texture_fns: filenames relative to the scene folder.
+            workers: number of processes, defaults to the cpu count.
+        """
+        stats = {fn: self._stat(fn) for fn in texture_fns}
+        stale = [fn for fn, st in stats.items()
+                 if fn not in self.entries or self.entries[fn]["stat"] != st]
+        if not stale:
+            return
+
+        print("Index %d textures..." % len(stale))
+        full_fns = [os.path.join(self.scene_folder, fn) for fn in stale]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            infos = list(tqdm(pool.map(_textureInfo, full_fns, chunksize=16),
+                              total=len(stale), ascii=True))
+        for fn, info in zip(stale, infos):
+            self.entries[fn] = dict(info, stat=stats[fn])
+        self.save()
+
+    def save(self):
+        with open(self.index_fn, "w") as f:
+            json.dump(self.entries, f)
+
+    def get(self, texture_fn):
+        """Get metadata of a texture
+
+        Args:
+            texture_fn: filename relative to the scene folder.
+        Returns:
+            Dict with "alpha" (alpha channel is really used), "size",
+            "frames" (animation frames) and "color" (average rgb in [0, 1]).
+        """
+        if texture_fn not in self.entries:
+            # Not under the indexed folders, read it once now
+            full_fn = os.path.join(self.scene_folder, texture_fn)
+            self.entries[texture_fn] = dict(_textureInfo(full_fn), stat=self._stat(texture_fn))
+        return self.entries[texture_fn]
+
+    def digest(self, texture_fns):
+        """Hash of the metadata of texture_fns, file stats left out"""
+        entries = [[fn, {k: v for k, v in self.get(fn).items() if k != "stat"}]
+                   for fn in sorted(texture_fns)]
+        return hashlib.sha1(json.dumps(entries, sort_keys=True).encode("utf-8")).hexdigest()
+
+def _freeze(data):
+    """Read-only copy of parsed json, dicts become mapping proxies"""
+    if isinstance(data, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in data.items()})
+    if isinstance(data, (list, tuple)):
+        return tuple(_freeze(v) for v in data)
+    return data
+
 @singleton
 class ResourceManager:
-    def __init__(self):
+    def __init__(self, model_bundle=True):
         self.local_model_folder = os.path.join(".", "models", "block")
         self.model_loader = ModelLoader(os.path.join(".", "models"))
         self.local_texture_folder = os.path.join("..", "scenes", "block")
         self.scene_folder = os.path.join("..", "scenes")
+        self.manifest_fn = os.path.join(".", "models", "assets.json")
+        self.version = "1.13.2"
         self.setup()
+        if model_bundle:
+            self.loadModelBundle(os.path.join(".", "models", "bundle.pickle"))
 
-        self.table_alpha = {}
+        # TextureAtlas the block faces are remapped into, if any
+        self.atlas = None
+
+        self.texture_index = TextureIndex(self.scene_folder, os.path.join(".", "models", "textures.json"))
+        block_folder = os.path.basename(self.local_texture_folder)
+        texture_fns = [block_folder + "/" + fn for fn in os.listdir(self.local_texture_folder)
+                       if fn.endswith(".png")]
+        self.texture_index.update(texture_fns)
+
+        # Changes whenever a copied asset or the metadata of a texture does
+        digest = json.dumps([self.manifest, self.texture_index.digest(texture_fns)], sort_keys=True)
+        self.assets_digest = hashlib.sha1(digest.encode("utf-8")).hexdigest()
 
     def hasAlpha(self, texture_fn):
-        """Check if texture file has alpha channel
+        """Check if texture file uses its alpha channel
 
         Args:
             texture_fn: filename of texture.
         Returns:
-            Texture has alpha channel or not.
+            Texture has a texel that is not fully opaque or not.
         """
-        if texture_fn not in self.table_alpha:
-            full_filename = os.path.join(self.local_texture_folder, "..", texture_fn)
-            image = Image.open(full_filename)
-            self.table_alpha[texture_fn] = len(image.mode) == 4
+        return self.texture_index.get(texture_fn)["alpha"]
 
-        return self.table_alpha[texture_fn]
+    def textureInfo(self, texture_fn):
+        """Get metadata of texture file, see TextureIndex.get"""
+        return self.texture_index.get(texture_fn)
 
-    def setup(self):
+    def setup(self, workers=4):
         """
            1. Copy Model.json into folder
            2. Copy Texture into folder
-        """
 
-        has_model = self.checkModelFolder()
-        has_texture = self.checkTextureFolder()
+        Only the needed members are streamed out of the client jar, straight
+        into their destination. The CRC32 and size of every copied file are
+        kept in a manifest with the jar version: when the manifest matches
+        the folders the jar is not opened at all, otherwise only missing or
+        changed files are copied again.
+
+        Args:
+            workers: number of threads reading the jar, 1 disables the pool.
+        """
 
-        if has_model and has_texture:
+        manifest = self.loadManifest()
+        if self.checkManifest(manifest):
+            self.manifest = manifest
             return
 
         minecraft_dir = getMinecraftFolder()
-        version = "1.13.2"
-        version_file = os.path.join(minecraft_dir, "versions", version, version + ".jar")
-        with tempfile.TemporaryDirectory() as temp_dir:
-            with zipfile.ZipFile(version_file, 'r') as vzip:
-                vzip.extractall(temp_dir)
-
-            if not has_model:
-                print("Copy model json files...", )
-                block_model_dir = os.path.join(temp_dir, "assets", "minecraft", "models", "block")
-                for filename in tqdm(os.listdir(block_model_dir), ascii=True):
-                    if filename.endswith(".json"):
-                        full_filename = os.path.join(block_model_dir, filename)
-                        shutil.copy(full_filename, self.local_model_folder)
-
-            if not has_texture:
-                print("Copy texture files...")
-                texture_dir = os.path.join(temp_dir, "assets", "minecraft", "textures", "block")
-                for filename in tqdm(os.listdir(texture_dir), ascii=True):
-                    full_filename = os.path.join(texture_dir, filename)
-                    shutil.copy(full_filename, self.local_texture_folder)
-
-    def checkModelFolder(self):
-        """Check if the folder has model json file
+        version_file = os.path.join(minecraft_dir, "versions", self.version, self.version + ".jar")
+        with zipfile.ZipFile(version_file, 'r') as vzip:
+            members = _selectMembers(vzip,
+                "assets/minecraft/models/block/", self.local_model_folder, ".json")
+            members += _selectMembers(vzip,
+                "assets/minecraft/textures/block/", self.local_texture_folder)
 
-        Returns:
-            Model json file is ready or not
-        """
-        json_list = [fn for fn in os.listdir(self.local_model_folder) if fn.endswith(".json")]
-        # Check with hash function ?
-        return len(json_list) > 0
+        old_files = manifest.get("files", {})
+        files = {}
+        changed = []
+        for info, dest in members:
+            files[dest] = [info.CRC, info.file_size]
+            if not self._isCopied(dest, files[dest], old_files.get(dest)):
+                changed.append((info, dest))
+
+        # Files the jar does not have anymore
+        for dest in old_files:
+            if dest not in files and os.path.exists(dest):
+                os.remove(dest)
+
+        print("Copy %d of %d model and texture files..." % (len(changed), len(members)))
+        _extractMembers(version_file, changed, workers)
+        self.manifest = {"version": self.version, "files": files}
+        self.saveManifest(self.manifest)
+
+    def loadModelBundle(self, bundle_fn):
+        """Load resolved models from bundle_fn, build it if it is outdated"""
+        key = json.dumps([ModelLoader.BUNDLE_VERSION, self.manifest], sort_keys=True)
+        key = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        if self.model_loader.loadBundle(bundle_fn, key):
+            return
+        print("Build model bundle...")
+        block_folder = os.path.basename(self.local_model_folder)
+        names = [block_folder + "/" + fn[:-5] for fn in os.listdir(self.local_model_folder)
+                 if fn.endswith(".json")]
+        self.model_loader.buildBundle(bundle_fn, key, names)
 
-    def checkTextureFolder(self):
-        """Check if the folder has texture pngs
+    def _isCopied(self, dest, entry, old_entry):
+        """Check if dest already holds the jar member described by entry"""
+        try:
+            if os.path.getsize(dest) != entry[1]:
+                return False
+        except OSError:
+            return False
+        if old_entry == entry:
+            return True
+        # Not in the manifest (or changed in the jar), compare content
+        return _fileCRC(dest) == entry[0]
+
+    def loadManifest(self):
+        """Load the asset manifest, empty if there is none"""
+        try:
+            with open(self.manifest_fn, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def saveManifest(self, manifest):
+        with open(self.manifest_fn, "w") as f:
+            json.dump(manifest, f, indent=1)
+
+    def checkManifest(self, manifest):
+        """Check if the folders hold the files of the manifest
+
+        Only the version and file sizes are checked, nothing is read.
 
         Returns:
-            Texture image file is ready or not
+            Models and textures are ready or not
         """
-
-        png_list = [fn for fn in os.listdir(self.local_texture_folder) if fn.endswith(".png")]
-        # Check with hash function ?
-        return len(png_list) > 0
+        if manifest.get("version") != self.version or not manifest.get("files"):
+            return False
+        for dest, (crc, size) in manifest["files"].items():
+            try:
+                if os.path.getsize(dest) != size:
+                    return False
+            except OSError:
+                return False
+        return True
 
 
 class ModelLoader:
+    BUNDLE_VERSION = 1
+
     def __init__(self, path = "."):
         self.path = path
         self.db = {}
+        self.resolved = {}
+        self.bundle = {}
 
     def _resolveTexture(self, data, texname):
         if texname[0] != '#' : return texname
@@ -120,7 +343,7 @@ class ModelLoader:
             return True
         return False
 
-    def _getModel(self, name): 
+    def _resolveModel(self, name):
         with open(self.path + "/" + name + ".json", "r") as f:
             data = json.load(f)
         
@@ -140,22 +363,81 @@ class ModelLoader:
                 return par_data, data["parent"]
         return data, ""
 
+    def _getModel(self, name):
+        """Resolve model name against its parents
+
+        Every model of the parent chain is read and resolved only once.
+        Returns a copy, callers are free to modify it.
+        """
+        if name not in self.resolved:
+            self.resolved[name] = self._resolveModel(name)
+        data, par = self.resolved[name]
+        return copy.deepcopy(data), par
+
+    def _scaleModel(self, model):
+        if "elements" in model:
+            for ele in model["elements"]:
+                ele["from"] = mult(ele["from"], 1./16)
+                ele["to"] = mult(ele["to"], 1./16)
+                for facename in ele["faces"]:
+                    face = ele["faces"][facename]
+                    uv = [0., 0., 1., 1.]
+                    if "uv" in face:
+                        uv = list(face["uv"])
+                        for i in range(4):
+                            uv[i] /= 16.
+                    # swap UV
+                    uv = [uv[1], uv[0], uv[3], uv[2]]
+                    face["uv"] = tuple(uv)
+
     def getModel(self, name):
+        """Get resolved model with block units and swapped UV
+
+        Returns:
+            (model, parent name), the model is read-only.
+        """
         if name not in self.db:
-            model, par = self._getModel(name)
-            self.db[name] = (model, par)
-            if "elements" in model:
-                for ele in model["elements"]:
-                    ele["from"] = mult(ele["from"], 1./16)
-                    ele["to"] = mult(ele["to"], 1./16)
-                    for facename in ele["faces"]:
-                        face = ele["faces"][facename]
-                        uv = [0., 0., 1., 1.]
-                        if "uv" in face:
-                            uv = list(face["uv"])
-                            for i in range(4):
-                                uv[i] /= 16.
-                        # swap UV
-                        uv = [uv[1], uv[0], uv[3], uv[2]]
-                        face["uv"] = tuple(uv)
+            if name in self.bundle:
+                model, par = self.bundle.pop(name)
+            else:
+                model, par = self._getModel(name)
+                self._scaleModel(model)
+            self.db[name] = (_freeze(model), par)
         return self.db[name]
+
+    def loadBundle(self, bundle_fn, key):
+        """Use the models of a bundle built with the same key
+
+        Returns:
+            Bundle is loaded or not.
+        """
+        try:
+            with open(bundle_fn, "rb") as f:
+                bundle = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False
+        if not isinstance(bundle, dict) or bundle.get("key") != key:
+            return False
+        self.bundle = bundle["models"]
+        return True
+
+    def buildBundle(self, bundle_fn, key, names):
+        """Resolve models names and save them in a bundle
+
+        Models that fail to resolve are left out, getModel raises for
+        them as usual.
+        """
+        models = {}
+        for name in names:
+            try:
+                model, par = self._getModel(name)
+            except (OSError, ValueError, KeyError):
+                continue
+            self._scaleModel(model)
+            models[name] = (model, par)
+
+        tmp_fn = bundle_fn + ".tmp"
+        with open(tmp_fn, "wb") as f:
+            pickle.dump({"key": key, "models": models}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_fn, bundle_fn)
+        self.bundle = models
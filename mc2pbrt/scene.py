@@ -1,4 +1,9 @@
+import os
+
+from atlas import TextureAtlas
 from block import BlockSolver
+from resource import ResourceManager
+from incremental import ChunkIncludeWriter
 from water import WaterSolver
 from lava import LavaSolver
 
@@ -13,6 +18,20 @@ class Scene:
 
         self.phenomenons = []
 
+        # Incremental export: blocks go to per chunk Include files
+        self.incremental = False
+        self.origin = (0, 0, 0)
+        self.chunk_stamps = {}
+
+        # Pack used block textures into atlas images
+        self.atlas = False
+
+        # Merge coplanar block faces, not with atlas textures which can't repeat
+        self.mesh = False
+
+        # Write every distinct block once and place it with ObjectInstance
+        self.instance = False
+
     def write(self, filename):
         print("Start write file ...")
         fout = open(filename, "w")
@@ -36,8 +55,30 @@ class Scene:
         for phenomenon in self.phenomenons:
             phenomenon.write(fout)
 
-        block_solver = BlockSolver(self.block)
-        block_solver.write(fout, stand_pt)
+        block_solver = BlockSolver(self.block, self.mesh and not self.atlas, self.instance)
+        block_solver.prepare(stand_pt)
+        # Chunk files refer to textures and models, rewrite them when those change
+        options = {"assets": ResourceManager().assets_digest}
+        if block_solver.mesh:
+            options["mesh"] = True
+        if block_solver.instance:
+            options["instance"] = True
+        if self.atlas:
+            atlas_name = os.path.splitext(os.path.basename(filename))[0] + "_atlas"
+            atlas = TextureAtlas(block_solver.used_texture, atlas_name)
+            atlas.save(os.path.dirname(filename))
+            ResourceManager().atlas = atlas
+            options["atlas"] = atlas.digest()
+
+        try:
+            chunk_writer = None
+            if self.incremental:
+                chunk_folder = os.path.splitext(filename)[0] + "_chunks"
+                chunk_writer = ChunkIncludeWriter(chunk_folder, self.origin, self.chunk_stamps, options)
+            block_solver.write(fout, stand_pt, chunk_writer)
+        finally:
+            # The atlas only belongs to this scene
+            ResourceManager().atlas = None
 
         water_solver = WaterSolver(self.block)
         water_solver.write(fout)
@@ -0,0 +1,84 @@
+"""TextureAtlas.remap keeps every face on the texels of its own image
+
+Run from the mc2pbrt folder:
+    $ python -m unittest discover tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import atlas
+import resource
+
+
+class _Resources:
+    """The part of ResourceManager TextureAtlas reads, over a temporary folder"""
+    def __init__(self, scene_folder):
+        self.scene_folder = scene_folder
+
+    def textureInfo(self, texture_fn):
+        return resource._textureInfo(os.path.join(self.scene_folder, texture_fn))
+
+    def hasAlpha(self, texture_fn):
+        return self.textureInfo(texture_fn)["alpha"]
+
+
+class TextureAtlasTest(unittest.TestCase):
+    # Face uvs as ModelLoader stores them: (row0, column0, row1, column1) in [0, 1]
+    FACES = [
+        (0., 0., 1., 1.),             # full face
+        (.5, 0., 1., 1.),             # side of a bottom slab, "uv": [0, 8, 16, 16]
+        (0., 0., .5, 1.),             # side of a top slab, "uv": [0, 0, 16, 8]
+        (.25, .375, .75, .625),       # torch-like sub-rect
+    ]
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.folder, "block"))
+        self.sizes = {"block/a": (16, 16), "block/b": (32, 32), "block/c": (16, 64), "block/d": (8, 16)}
+        for tex, (w, h) in self.sizes.items():
+            # Every texel of every image has its own colour
+            image = Image.new("RGBA", (w, h))
+            base = sorted(self.sizes).index(tex) * 64
+            image.putdata([(base + y, x, (x*7 + y*3) % 256, 255) for y in range(h) for x in range(w)])
+            image.save(os.path.join(self.folder, tex + ".png"))
+        self.resource_manager = atlas.ResourceManager
+        atlas.ResourceManager = lambda: _Resources(self.folder)
+
+    def tearDown(self):
+        atlas.ResourceManager = self.resource_manager
+        shutil.rmtree(self.folder)
+
+    def test_sub_rect_faces(self):
+        tex_atlas = atlas.TextureAtlas(self.sizes, "atlas", max_size=64)
+        tex_atlas.save(self.folder)
+        self.assertGreater(len(tex_atlas.pages), 1)
+        pages = [Image.open(os.path.join(self.folder, tex_atlas.pageName(i) + ".png")).convert("RGBA")
+                 for i in range(len(tex_atlas.pages))]
+
+        for tex, (w, h) in self.sizes.items():
+            image = Image.open(os.path.join(self.folder, tex + ".png")).convert("RGBA")
+            for uv in TextureAtlasTest.FACES:
+                page_name, (u0, v0, u1, v1) = tex_atlas.remap(tex, uv)
+                page = pages[int(page_name[len("atlas"):])]
+                page_w, page_h = page.size
+                # Texel centres of the face, along u (rows) and v (columns)
+                rows, cols = round((uv[2] - uv[0])*h), round((uv[3] - uv[1])*w)
+                for i in range(rows):
+                    for j in range(cols):
+                        s, t = (i + .5) / rows, (j + .5) / cols
+                        expected = image.getpixel((int((uv[1] + t*(uv[3] - uv[1]))*w),
+                                                   int((uv[0] + s*(uv[2] - uv[0]))*h)))
+                        got = page.getpixel((int((v0 + t*(v1 - v0))*page_w),
+                                             int((u0 + s*(u1 - u0))*page_h)))
+                        self.assertEqual(got, expected, "%s %s texel (%d, %d)" % (tex, uv, i, j))
+
+
+if __name__ == "__main__":
+    unittest.main()
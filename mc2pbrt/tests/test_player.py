@@ -0,0 +1,138 @@
+"""Player UUID resolution against a local stub of the Mojang API
+
+Run from the mc2pbrt folder:
+    $ python -m unittest discover tests
+"""
+import gzip
+import http.server
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pyanvil.nbt as nbt
+import pyanvil.stream as stream
+from pyanvil.player import Player
+
+ONLINE_UUID = "0123456789abcdef0123456789abcdef"
+# Offline mode UUID of Notch, as given by an offline-mode server
+NOTCH_OFFLINE_UUID = "b50ad385829d3141a2167e7d7539ba7f"
+
+
+class _StubAPI(http.server.BaseHTTPRequestHandler):
+    """Answers every profile lookup with ONLINE_UUID and records the path"""
+    paths = []
+
+    def do_GET(self):
+        _StubAPI.paths.append(self.path)
+        body = json.dumps({"id": ONLINE_UUID, "name": "Steve"}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class PlayerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.HTTPServer(("127.0.0.1", 0), _StubAPI)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.api_url = "http://127.0.0.1:%d" % cls.server.server_port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        _StubAPI.paths = []
+        self.folder = tempfile.mkdtemp()
+        self.world = os.path.join(self.folder, "world")
+        os.makedirs(os.path.join(self.world, "playerdata"))
+        self.cache_file = os.path.join(self.folder, "uuid_cache.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _writePlayer(self, uuid, pos=(1.5, 64.0, -3.5)):
+        root = nbt.CompoundTag("", [
+            nbt.ListTag("Pos", nbt.DoubleTag.clazz_id, [nbt.DoubleTag("None", v) for v in pos]),
+            nbt.ListTag("Rotation", nbt.FloatTag.clazz_id, [nbt.FloatTag("None", v) for v in (10., 20.)]),
+            nbt.IntTag("Dimension", 0),
+        ])
+        out = stream.OutputStream()
+        root.serialize(out)
+        filename = "-".join([uuid[:8], uuid[8:12], uuid[12:16], uuid[16:20], uuid[20:]])
+        with gzip.open(os.path.join(self.world, "playerdata", filename + ".dat"), "wb") as f:
+            f.write(out.get_data())
+
+    def _player(self, username, **kwargs):
+        kwargs.setdefault("cache_file", self.cache_file)
+        return Player(self.world, username, api_url=self.api_url, **kwargs)
+
+    def test_explicit_uuid(self):
+        self._writePlayer(ONLINE_UUID)
+        player = self._player("Steve", uuid="01234567-89AB-CDEF-0123-456789ABCDEF")
+        self.assertEqual(player.uuid, ONLINE_UUID)
+        self.assertEqual(player.pos, [1.5, 64.0, -3.5])
+        self.assertEqual(player.rot, [10., 20.])
+        self.assertEqual(player.dim, 0)
+        self.assertEqual(_StubAPI.paths, [])
+
+    def test_offline_argument(self):
+        self._writePlayer(NOTCH_OFFLINE_UUID)
+        self.assertEqual(self._player("Notch", uuid="offline").uuid, NOTCH_OFFLINE_UUID)
+        self.assertEqual(_StubAPI.paths, [])
+
+    def test_offline_playerdata(self):
+        self._writePlayer(NOTCH_OFFLINE_UUID)
+        self.assertEqual(self._player("Notch").uuid, NOTCH_OFFLINE_UUID)
+        self.assertEqual(_StubAPI.paths, [])
+
+    def test_server_usercache(self):
+        self._writePlayer(ONLINE_UUID)
+        with open(os.path.join(self.folder, "usercache.json"), "w") as f:
+            json.dump([{"name": "Alex", "uuid": "01234567-89ab-cdef-0123-456789abcdef",
+                        "expiresOn": "2030-01-01 00:00:00 +0000"}], f)
+        self.assertEqual(self._player("alex").uuid, ONLINE_UUID)
+        self.assertEqual(_StubAPI.paths, [])
+
+    def test_launcher_usercache(self):
+        self._writePlayer(ONLINE_UUID)
+        launcher = os.path.join(self.folder, "launcher")
+        os.makedirs(launcher)
+        with open(os.path.join(launcher, "usercache.json"), "w") as f:
+            json.dump([{"name": "Alex", "uuid": "01234567-89ab-cdef-0123-456789abcdef"}], f)
+        self.assertEqual(self._player("Alex", launcher_path=launcher).uuid, ONLINE_UUID)
+        self.assertEqual(_StubAPI.paths, [])
+
+    def test_api_then_uuid_cache(self):
+        self._writePlayer(ONLINE_UUID)
+        self.assertEqual(self._player("Steve").uuid, ONLINE_UUID)
+        self.assertEqual(_StubAPI.paths, ["/users/profiles/minecraft/Steve"])
+        with open(self.cache_file, "r") as f:
+            self.assertEqual(json.load(f), {"steve": ONLINE_UUID})
+
+        # The second lookup is answered by uuid_cache.json
+        self.assertEqual(self._player("STEVE").uuid, ONLINE_UUID)
+        self.assertEqual(len(_StubAPI.paths), 1)
+
+    def test_uuid_cache(self):
+        self._writePlayer(ONLINE_UUID)
+        with open(self.cache_file, "w") as f:
+            json.dump({"steve": ONLINE_UUID}, f)
+        self.assertEqual(self._player("Steve").uuid, ONLINE_UUID)
+        self.assertEqual(_StubAPI.paths, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
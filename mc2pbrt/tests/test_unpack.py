@@ -0,0 +1,49 @@
+"""unpack_block_states against the per block reference decoder
+
+Run from the mc2pbrt folder:
+    $ python -m unittest discover tests
+"""
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pyanvil.world import Chunk, pack_block_states, unpack_block_states
+
+
+class UnpackBlockStatesTest(unittest.TestCase):
+    def setUp(self):
+        self.rnd = random.Random(0)
+
+    def _states(self, width):
+        return [self.rnd.randrange(1 << width) for _ in range(4096)]
+
+    def test_spanning_matches_read_width_from_loc(self):
+        for width in range(4, 13):
+            states = self._states(width)
+            longs = pack_block_states(states, width, True)
+            ref = [Chunk._read_width_from_loc(longs, width, i) for i in range(4096)]
+            self.assertEqual(ref, states, "width %d" % width)
+            self.assertEqual(list(unpack_block_states(longs, 1 << width)), ref, "width %d" % width)
+
+    def test_non_spanning(self):
+        for width in range(4, 13):
+            states = self._states(width)
+            longs = pack_block_states(states, width, False)
+            self.assertEqual(list(unpack_block_states(longs, 1 << width)), states, "width %d" % width)
+
+    def test_list_input(self):
+        states = self._states(5)
+        longs = pack_block_states(states, 5, True)
+        self.assertEqual(list(unpack_block_states(list(longs), 32)), states)
+
+    def test_small_palette_uses_four_bits(self):
+        states = self._states(2)
+        longs = pack_block_states(states, 4, True)
+        self.assertEqual(list(unpack_block_states(longs, 3)), states)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -31,3 +31,7 @@ pt_map = {
     "north" : (lambda c: (0, 0, c[2]/2), lambda c: (c[1], c[0]), 1, "quadz"),
     "south" : (lambda c: (0, 0, -c[2]/2), lambda c: (c[1], c[0]), -1, "quadz")
 }
+
+# Neighbour offset of the side each face is drawn on, and its bit in cull masks
+face_delta = {name: tuple(int(2*c) for c in pt_map[name][0]((1, 1, 1))) for name in pt_map}
+face_bit = {name: 1 << i for i, name in enumerate(pt_map)}